@@ -0,0 +1,31 @@
+"""fetch ledger
+
+Revision ID: 8c1f3e7a9b42
+Revises: 5a57ee0d7001
+Create Date: 2026-10-18 09:12:41.508311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1f3e7a9b42'
+down_revision = '5a57ee0d7001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fetch_ledger',
+    sa.Column('endpoint', sa.String(length=64), nullable=False),
+    sa.Column('player_id', sa.String(length=256), nullable=False),
+    sa.Column('season_id', sa.String(length=256), nullable=False),
+    sa.Column('status', sa.String(length=64), nullable=False),
+    sa.Column('fetched_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('endpoint', 'player_id', 'season_id')
+    )
+
+
+def downgrade():
+    op.drop_table('fetch_ledger')
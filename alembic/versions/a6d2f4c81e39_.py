@@ -0,0 +1,57 @@
+"""player daily stats rollup
+
+Revision ID: a6d2f4c81e39
+Revises: f3b8d61a2c57
+Create Date: 2026-10-18 15:21:07.418266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2f4c81e39'
+down_revision = 'f3b8d61a2c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('player_daily_stats',
+    sa.Column('player_id', sa.String(length=256), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('game_mode', sa.String(length=64), nullable=False),
+    sa.Column('map_name', sa.String(length=64), nullable=False),
+    sa.Column('matches', sa.Integer(), nullable=False),
+    sa.Column('wins', sa.Integer(), nullable=False),
+    sa.Column('top10s', sa.Integer(), nullable=False),
+    sa.Column('kills', sa.Integer(), nullable=False),
+    sa.Column('assists', sa.Integer(), nullable=False),
+    sa.Column('DBNOs', sa.Integer(), nullable=False),
+    sa.Column('headshotKills', sa.Integer(), nullable=False),
+    sa.Column('revives', sa.Integer(), nullable=False),
+    sa.Column('damageDealt', sa.Float(), nullable=False),
+    sa.Column('longestKill', sa.Float(), nullable=False),
+    sa.Column('timeSurvived', sa.Float(), nullable=False),
+    sa.Column('walkDistance', sa.Float(), nullable=False),
+    sa.Column('rideDistance', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('player_id', 'day', 'game_mode', 'map_name')
+    )
+
+    # fill it from the history there is so far; the sync keeps it up to date
+    # from here on
+    op.execute(
+        "INSERT INTO player_daily_stats "
+        "SELECT pms.player_id, DATE(m.createdAt), m.gameMode, m.mapName, COUNT(*), "
+        "SUM(CASE WHEN pms.winPlace = 1 THEN 1 ELSE 0 END), "
+        "SUM(CASE WHEN pms.winPlace <= 10 THEN 1 ELSE 0 END), "
+        "SUM(pms.kills), SUM(pms.assists), SUM(pms.DBNOs), SUM(pms.headshotKills), "
+        "SUM(pms.revives), SUM(pms.damageDealt), MAX(pms.longestKill), "
+        "SUM(pms.timeSurvived), SUM(pms.walkDistance), SUM(pms.rideDistance) "
+        "FROM player_match_stats pms JOIN matches m ON pms.match_id = m.match_id "
+        "GROUP BY pms.player_id, DATE(m.createdAt), m.gameMode, m.mapName"
+    )
+
+
+def downgrade():
+    op.drop_table('player_daily_stats')
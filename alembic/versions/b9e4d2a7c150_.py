@@ -0,0 +1,53 @@
+"""secondary indexes and optional monthly partitioning of matches
+
+Revision ID: b9e4d2a7c150
+Revises: a6d2f4c81e39
+Create Date: 2026-10-18 16:04:31.902113
+
+"""
+import os
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e4d2a7c150'
+down_revision = 'a6d2f4c81e39'
+branch_labels = None
+depends_on = None
+
+# the tables that point at matches.match_id. InnoDB gave each an unnamed
+# index for its foreign key already; the named ones replace those, and stay
+# if the foreign keys go (see database/partitioning.py)
+MATCH_ID_INDEXES = ('player_matches', 'season_matches', 'player_match_stats')
+
+
+def upgrade():
+    op.create_index('ix_matches_createdAt', 'matches', ['createdAt', 'gameMode', 'mapName'], unique=False)
+
+    for table in MATCH_ID_INDEXES:
+        op.create_index('ix_{0}_match_id'.format(table), table, ['match_id'], unique=False)
+
+    # partitioning is opt in: it rebuilds the whole matches table, and drops
+    # the foreign keys onto it
+    conn = op.get_bind()
+
+    if os.environ.get('PUBGDB_PARTITION_MATCHES') and conn.dialect.name == 'mysql':
+        # imported here as env.py is what puts the repo on the path
+        from database.partitioning import partition_matches
+        partition_matches(conn)
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    if conn.dialect.name == 'mysql':
+        from database.partitioning import unpartition_matches
+        unpartition_matches(conn)
+
+    for table in MATCH_ID_INDEXES:
+        # the foreign key needs an index on match_id to be there at all times
+        op.create_index('match_id', table, ['match_id'], unique=False)
+        op.drop_index('ix_{0}_match_id'.format(table), table_name=table)
+
+    op.drop_index('ix_matches_createdAt', table_name='matches')
@@ -0,0 +1,31 @@
+"""player watermarks
+
+Revision ID: d41b7c2e5f03
+Revises: 8c1f3e7a9b42
+Create Date: 2026-10-18 10:03:17.220945
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41b7c2e5f03'
+down_revision = '8c1f3e7a9b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('player_watermarks',
+    sa.Column('player_id', sa.String(length=256), nullable=False),
+    sa.Column('last_match_id', sa.String(length=256), nullable=True),
+    sa.Column('last_match_createdAt', sa.DateTime(), nullable=True),
+    sa.Column('last_stats_refresh', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['player_id'], ['players.player_id'], ),
+    sa.PrimaryKeyConstraint('player_id')
+    )
+
+
+def downgrade():
+    op.drop_table('player_watermarks')
@@ -0,0 +1,40 @@
+"""sync run state
+
+Revision ID: e7a2c9d4b816
+Revises: d41b7c2e5f03
+Create Date: 2026-10-18 11:21:40.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c9d4b816'
+down_revision = 'd41b7c2e5f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sync_runs',
+    sa.Column('run_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('phase', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('run_id')
+    )
+    op.create_table('sync_run_items',
+    sa.Column('run_id', sa.Integer(), nullable=False),
+    sa.Column('phase', sa.String(length=64), nullable=False),
+    sa.Column('item_key', sa.String(length=512), nullable=False),
+    sa.Column('status', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['run_id'], ['sync_runs.run_id'], ),
+    sa.PrimaryKeyConstraint('run_id', 'phase', 'item_key')
+    )
+
+
+def downgrade():
+    op.drop_table('sync_run_items')
+    op.drop_table('sync_runs')
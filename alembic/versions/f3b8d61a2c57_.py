@@ -0,0 +1,39 @@
+"""sync leases and match claims
+
+Revision ID: f3b8d61a2c57
+Revises: e7a2c9d4b816
+Create Date: 2026-10-18 13:02:55.710364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d61a2c57'
+down_revision = 'e7a2c9d4b816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sync_leases',
+    sa.Column('partition_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('worker_id', sa.String(length=256), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('synced_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('partition_id')
+    )
+    op.create_table('match_claims',
+    sa.Column('match_id', sa.String(length=256), nullable=False),
+    sa.Column('worker_id', sa.String(length=256), nullable=False),
+    sa.Column('claimed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('match_id')
+    )
+    op.add_column('sync_runs', sa.Column('partition_id', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('sync_runs', 'partition_id')
+    op.drop_table('match_claims')
+    op.drop_table('sync_leases')
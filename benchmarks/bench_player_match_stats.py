@@ -0,0 +1,161 @@
+"""
+Microbenchmark for upsert_player_match_stats.
+
+Builds synthetic match payloads shaped like the /matches endpoint's (100
+participants plus rosters and an asset per match) and times
+upsert_player_match_stats(), from the players' API objects to the rows
+written, across numbers of tracked players and matches. The participant
+filter used to be a list membership test rebuilt per participant, which made
+this O(matches x participants x players); with the set lookup the time should
+barely move as the number of tracked players grows, as each match has the same
+few tracked players in it. --check exits non-zero if it does.
+
+The rows go into an in-memory SQLite DB unless --db-uri names another one.
+
+Run from the repo root:
+
+    python benchmarks/bench_player_match_stats.py
+"""
+
+import sys
+import os
+import time
+import random
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database.model import Base, PlayerMatchStats
+from database.api import PUBGDatabaseConnector
+
+PARTICIPANTS_PER_MATCH = 100
+ROSTERS_PER_MATCH = 25
+
+
+def participant(player_id):
+    return {
+        'type': 'participant',
+        'attributes': {
+            'stats': {
+                'playerId': player_id,
+                'DBNOs': 1,
+                'assists': 0,
+                'boosts': 2,
+                'damageDealt': 123.4,
+                'deathType': 'byplayer',
+                'headshotKills': 0,
+                'heals': 3,
+                'killPlace': 40,
+                'kills': 1,
+                'longestKill': 12.3,
+                'revives': 0,
+                'rideDistance': 1000.,
+                'roadKills': 0,
+                'swimDistance': 0.,
+                'teamKills': 0,
+                'timeSurvived': 900.,
+                'vehicleDestroys': 0,
+                'walkDistance': 1500.,
+                'weaponsAcquired': 4,
+                'winPlace': 20
+            }
+        }
+    }
+
+
+def build_matches(num_matches, tracked_ids, tracked_per_match=4):
+    """
+    Each match has a handful of tracked players, the rest are strangers.
+    """
+
+    matches = []
+
+    for i in range(num_matches):
+        tracked = random.sample(tracked_ids, min(tracked_per_match, len(tracked_ids)))
+        strangers = ['account.stranger{0}-{1}'.format(i, j) for j in range(PARTICIPANTS_PER_MATCH - len(tracked))]
+
+        included = [participant(player_id) for player_id in tracked + strangers]
+        included += [{'type': 'roster', 'attributes': {}} for j in range(ROSTERS_PER_MATCH)]
+        included.append({'type': 'asset', 'attributes': {}})
+        random.shuffle(included)
+
+        matches.append({'data': {'id': 'match-{0}'.format(i)}, 'included': included})
+
+    return matches
+
+
+def time_upsert(pubgdb, matches, players, repeat):
+    best = None
+
+    for i in range(repeat):
+        pubgdb.engine.execute(PlayerMatchStats.__table__.delete())
+
+        start = time.perf_counter()
+        pubgdb.upsert_player_match_stats(matches, players)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+@click.command()
+@click.option('--players', 'player_counts', default='10,100,1000', help='Comma separated numbers of tracked players')
+@click.option('--matches', 'match_counts', default='1000,10000', help='Comma separated numbers of matches')
+@click.option('--repeat', default=3, help='Runs per case, the best is reported')
+@click.option('--check', is_flag=True, help='Fail if the time grows more than --max-ratio with the number of players')
+@click.option('--max-ratio', default=3., help='Largest allowed time ratio between the most and fewest players')
+@click.option('--db-uri', default='sqlite://', help='Scratch DB to write the rows to (default in-memory SQLite)')
+def bench(player_counts, match_counts, repeat, check, max_ratio, db_uri):
+    """
+    Time upsert_player_match_stats() for each combination of tracked players
+    and matches.
+    """
+
+    random.seed(0)
+
+    pubgdb = PUBGDatabaseConnector(db_uri)
+    Base.metadata.create_all(pubgdb.engine, tables=[PlayerMatchStats.__table__])
+
+    player_counts = [int(n) for n in player_counts.split(',')]
+    match_counts = [int(n) for n in match_counts.split(',')]
+
+    print('{0:>8} {1:>8} {2:>12} {3:>10} {4:>14}'.format('players', 'matches', 'participants', 'seconds', 'us/participant'))
+
+    failed = False
+
+    for num_matches in match_counts:
+        timings = []
+
+        for num_players in player_counts:
+            tracked_ids = ['account.tracked{0}'.format(i) for i in range(num_players)]
+            matches = build_matches(num_matches, tracked_ids)
+
+            elapsed = time_upsert(pubgdb, matches, [{'id': player_id} for player_id in tracked_ids], repeat)
+            participants = num_matches * PARTICIPANTS_PER_MATCH
+            timings.append(elapsed)
+
+            print('{0:>8} {1:>8} {2:>12} {3:>10.3f} {4:>14.3f}'.format(
+                num_players,
+                num_matches,
+                participants,
+                elapsed,
+                elapsed / participants * 1e6
+            ))
+
+        ratio = timings[-1] / timings[0]
+        print('{0} matches: {1} -> {2} players took {3:.2f}x as long'.format(num_matches, player_counts[0], player_counts[-1], ratio))
+
+        if ratio > max_ratio:
+            failed = True
+
+    Base.metadata.drop_all(pubgdb.engine, tables=[PlayerMatchStats.__table__])
+
+    if check and failed:
+        print('FAIL: time grows with the number of tracked players')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    bench()
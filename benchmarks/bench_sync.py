@@ -0,0 +1,224 @@
+"""
+End-to-end benchmark of a sync pass, against the fake API in fake_api.py so
+it costs no API quota.
+
+Starts a fake API in-process, points pubg_api at it and runs one pass of
+sync.py's __sync into a DB: a throwaway SQLite file by default, or whatever
+--db-uri names (a scratch MySQL schema, say, which is what the sync runs on
+for real). Reports the wall time of each phase of the sync, matches written
+per second and API calls per second, and appends the results, with the git
+revision and the parameters, to a JSON lines file so that runs can be
+compared over time. --check exits non-zero if the run was slower than the
+last one with the same parameters by more than --max-regression.
+
+Run from the repo root:
+
+    python benchmarks/bench_sync.py --players 50 --matches-per-player 20
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+import subprocess
+import logging
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sync
+import metrics
+from database.model import Base
+from database.api import PUBGDatabaseConnector
+from database.runstate import SyncRunState, COMPLETE
+from pubg.pubg_api import pubg_api
+from pubg.scheduler import BudgetScheduler
+from fake_api import FakeData, FakeRateLimiter, FakeAPIServer, DEFAULT_RATE_LIMIT, DEFAULT_RATE_WINDOW
+
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(results_path, params):
+    """
+    The last result stored with the same parameters, if any.
+    """
+
+    if not os.path.exists(results_path):
+        return None
+
+    previous = None
+
+    with open(results_path) as f:
+        for line in f:
+            result = json.loads(line)
+
+            if result['params'] == params:
+                previous = result
+
+    return previous
+
+
+def phase_seconds():
+    """
+    The seconds spent so far in each phase of the sync, from the metrics the
+    run state keeps as it moves between phases. Unlike the profiler, these
+    cost nothing to collect, so they don't slow the run they're timing.
+    """
+
+    with metrics.REGISTRY.lock:
+        counters = dict(metrics.REGISTRY.counters)
+
+    return {
+        dict(labels)['phase']: value
+        for (name, labels), value in counters.items()
+        if name == 'sync_phase_seconds_total'
+    }
+
+
+def run(params, db_uri):
+    """
+    One sync pass against a fresh fake API, returning the results.
+    """
+
+    data = FakeData(params['players'], params['matches_per_player'], params['match_pool'], params['seasons'])
+    server = FakeAPIServer(('127.0.0.1', 0), data, FakeRateLimiter(params['rate_limit'], params['rate_window']), params['latency'])
+    base_url = server.start()
+
+    keys = ['bench-key-{0}'.format(i) for i in range(params['keys'])]
+    os.environ['PUBG_API_KEYS'] = ','.join(keys)
+    os.environ['PUBG_API_KEY'] = keys[0]
+
+    pubgdb = PUBGDatabaseConnector(db_uri, False)
+    Base.metadata.create_all(pubgdb.engine)
+
+    config = {
+        'base_url': base_url,
+        'shard': 'steam',
+        'players': data.player_names,
+        'engine': params['engine'],
+        'concurrency': params['concurrency'],
+        'cache_path': None
+    }
+
+    api = pubg_api(config)
+    run_state = SyncRunState(pubgdb)
+    run_state.start(False)
+
+    phases_before = phase_seconds()
+
+    try:
+        started = time.perf_counter()
+
+        sync.__sync(
+            api,
+            pubgdb,
+            run_state,
+            BudgetScheduler(api, None, None),
+            params['stream']
+        )
+
+        wall = time.perf_counter() - started
+    finally:
+        api.close()
+        server.shutdown()
+
+    phases = {
+        phase: round(seconds - phases_before.get(phase, 0.), 3)
+        for phase, seconds in phase_seconds().items()
+        if phase not in ('none', COMPLETE) and seconds > phases_before.get(phase, 0.)
+    }
+    calls = sum(server.calls.values())
+    rate_limited = sum(count for (endpoint, status), count in server.calls.items() if status == 429)
+    matches = len(data.match_players)
+
+    return {
+        'wall_seconds': round(wall, 3),
+        'phase_seconds': phases,
+        'matches': matches,
+        'matches_per_second': round(matches / wall, 2),
+        'api_calls': calls,
+        'api_calls_per_second': round(calls / wall, 2),
+        'rate_limited': rate_limited
+    }
+
+
+@click.command()
+@click.option('--players', default=50, help='Number of players to sync')
+@click.option('--matches-per-player', default=20, help='Matches each player has played')
+@click.option('--match-pool', default=None, type=int, help='Number of distinct matches (default players x matches per player)')
+@click.option('--seasons', default=4, help='Number of seasons, the last one current')
+@click.option('--keys', default=1, help='Number of API keys to spread the calls over')
+@click.option('--rate-limit', default=DEFAULT_RATE_LIMIT, help='Calls per window per key on each rate limited endpoint')
+@click.option('--rate-window', default=DEFAULT_RATE_WINDOW, help='Length of the rate limit window in seconds')
+@click.option('--latency', default=0., help='Seconds the fake API sleeps before each response')
+@click.option('--engine', type=click.Choice(['asyncio', 'pool']), default='asyncio', help='Fetch engine')
+@click.option('--concurrency', default=16, help='Calls in flight at once')
+@click.option('--stream/--no-stream', default=False, help='Write matches while they are fetched')
+@click.option('--db-uri', default=None, help='DB to sync into (default a temporary SQLite file)')
+@click.option('--results', default=DEFAULT_RESULTS_PATH, help='JSON lines file the results are appended to')
+@click.option('--check', is_flag=True, help='Exit non-zero if slower than the last run with the same parameters')
+@click.option('--max-regression', default=0.2, help='How much slower than the last run --check allows, as a fraction')
+def bench(players, matches_per_player, match_pool, seasons, keys, rate_limit, rate_window, latency, engine, concurrency, stream, db_uri, results, check, max_regression):
+    logging.basicConfig(level=logging.WARNING)
+
+    params = dict(
+        players=players,
+        matches_per_player=matches_per_player,
+        match_pool=match_pool,
+        seasons=seasons,
+        keys=keys,
+        rate_limit=rate_limit,
+        rate_window=rate_window,
+        latency=latency,
+        engine=engine,
+        concurrency=concurrency,
+        stream=stream,
+        db=(db_uri or 'sqlite').split(':')[0]
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(params, db_uri or 'sqlite:///' + os.path.join(tmp, 'bench.sqlite'))
+
+    print('{0:>16} {1:>10}'.format('phase', 'seconds'))
+
+    for phase, seconds in result['phase_seconds'].items():
+        print('{0:>16} {1:>10.3f}'.format(phase, seconds))
+
+    print('{0:>16} {1:>10.3f}'.format('total', result['wall_seconds']))
+    print()
+    print('{0} matches at {1} matches/s, {2} API calls at {3} calls/s ({4} rate limited)'.format(
+        result['matches'], result['matches_per_second'], result['api_calls'], result['api_calls_per_second'], result['rate_limited']
+    ))
+
+    previous = previous_result(results, params)
+
+    with open(results, 'a') as f:
+        f.write(json.dumps(dict(
+            timestamp=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            revision=git_revision(),
+            params=params,
+            results=result
+        )) + '\n')
+
+    if previous is None:
+        return None
+
+    change = result['wall_seconds'] / previous['results']['wall_seconds'] - 1
+
+    print('{0:+.1%} wall time against {1} at {2}'.format(change, previous['revision'], previous['timestamp']))
+
+    if check and change > max_regression:
+        print('Regression: more than {0:.0%} slower than the last run'.format(max_regression))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    bench()
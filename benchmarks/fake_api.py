@@ -0,0 +1,389 @@
+"""
+A local stand-in for the PUBG API, for benchmarking the sync without spending
+any real API quota.
+
+It serves synthetic but correctly shaped responses for every endpoint
+pubg_api calls: /players, /matches/{id}, /seasons, the single-player season,
+ranked and lifetime stats and the batched stats endpoints. The data is
+generated on demand from a seed, scaled by the number of players, the
+matches each has played and the number of matches they're drawn from (fewer
+matches than players x matches each means shared matches). The rate limited
+endpoints send X-Ratelimit-* headers and answer HTTP 429 once a key's window
+is used up, as the real API does; /matches isn't limited.
+
+Run it on its own for manual testing, then point the sync at it with
+"base_url": "http://127.0.0.1:8080/shards/" in config.json:
+
+    python benchmarks/fake_api.py --players 100 --port 8080
+
+bench_sync.py starts one in-process.
+"""
+
+import sys
+import os
+import json
+import random
+import threading
+import time
+import datetime
+import hashlib
+import re
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from database.model import PlayerSeasonStats, PlayerRankedSeasonStats, PlayerMatchStats
+from pubg.ratelimit import endpoint_for
+
+PARTICIPANTS_PER_MATCH = 100
+ROSTERS_PER_MATCH = 25
+GAME_MODES = ['solo', 'solo-fpp', 'duo', 'duo-fpp', 'squad', 'squad-fpp']
+
+# The stats fields each kind of record carries, taken from the tables they
+# end up in so the two can't drift apart
+SEASON_STATS_FIELDS = [c.name for c in PlayerSeasonStats.__table__.columns if c.name not in ('player_id', 'season_id', 'game_mode')]
+RANKED_STATS_FIELDS = [c.name for c in PlayerRankedSeasonStats.__table__.columns if c.name not in ('player_id', 'season_id', 'game_mode') and '_' not in c.name]
+MATCH_STATS_FIELDS = [c.name for c in PlayerMatchStats.__table__.columns if c.name not in ('player_id', 'match_id')]
+
+# Defaults for the rate limit on each class of endpoint, per key
+DEFAULT_RATE_LIMIT = 1000
+DEFAULT_RATE_WINDOW = 60
+
+
+class FakeData:
+    """
+    The synthetic players, matches and seasons. Everything is derived from the
+    seed and the names or IDs asked for, so any response can be built on
+    demand and is the same every time it's asked for.
+    """
+
+    def __init__(self, players=100, matches_per_player=20, match_pool=None, seasons=4, seed=0):
+        self.seed = seed
+        self.player_names = ['player{0}'.format(i) for i in range(players)]
+        self.player_ids = {name: 'account.{0}'.format(self.digest(name)[:32]) for name in self.player_names}
+        self.names_by_id = {player_id: name for name, player_id in self.player_ids.items()}
+
+        match_pool = match_pool or players * matches_per_player
+        self.match_ids = ['{0}-{1}'.format(self.digest('match', i)[:8], self.digest('match', i)[8:20]) for i in range(match_pool)]
+
+        rng = random.Random(seed)
+        self.player_matches = {
+            player_id: rng.sample(self.match_ids, min(matches_per_player, match_pool))
+            for player_id in self.player_ids.values()
+        }
+
+        self.match_players = {}
+
+        for player_id, match_ids in self.player_matches.items():
+            for match_id in match_ids:
+                self.match_players.setdefault(match_id, []).append(player_id)
+
+        self.season_ids = ['division.bro.official.pc-2018-{0:02d}'.format(i + 1) for i in range(seasons)]
+
+        return None
+
+    def digest(self, *parts):
+        return hashlib.sha1(repr((self.seed,) + parts).encode('utf-8')).hexdigest()
+
+    def rng(self, *parts):
+        return random.Random(self.digest(*parts))
+
+    def player(self, name):
+        player_id = self.player_ids[name]
+
+        return {
+            'type': 'player',
+            'id': player_id,
+            'attributes': {'name': name, 'shardId': 'steam', 'patchVersion': '', 'titleId': 'bluehole-pubg'},
+            'relationships': {
+                'matches': {'data': [{'type': 'match', 'id': m} for m in self.player_matches[player_id]]}
+            }
+        }
+
+    def seasons(self):
+        return [
+            {
+                'type': 'season',
+                'id': season_id,
+                'attributes': {'isCurrentSeason': i == len(self.season_ids) - 1, 'isOffseason': False}
+            }
+            for i, season_id in enumerate(self.season_ids)
+        ]
+
+    def match(self, match_id):
+        rng = self.rng('match', match_id)
+        created_at = datetime.datetime(2019, 1, 1) + datetime.timedelta(seconds=rng.randrange(365 * 86400))
+
+        tracked = self.match_players.get(match_id, [])
+        player_ids = tracked + ['account.stranger{0}'.format(self.digest(match_id, i)[:24]) for i in range(PARTICIPANTS_PER_MATCH - len(tracked))]
+
+        included = []
+
+        for player_id in player_ids:
+            stats = {field: rng.randrange(100) for field in MATCH_STATS_FIELDS}
+            stats.update(playerId=player_id, name=self.names_by_id.get(player_id, player_id), deathType='byplayer')
+            included.append({'type': 'participant', 'id': self.digest(match_id, player_id)[:36], 'attributes': {'actor': '', 'shardId': 'steam', 'stats': stats}})
+
+        for i in range(ROSTERS_PER_MATCH):
+            included.append({'type': 'roster', 'id': self.digest(match_id, 'roster', i)[:36], 'attributes': {'won': 'false', 'shardId': 'steam', 'stats': {'rank': i + 1, 'teamId': i + 1}}})
+
+        included.append({'type': 'asset', 'id': self.digest(match_id, 'asset')[:36], 'attributes': {'name': 'telemetry', 'URL': 'https://telemetry-cdn.pubg.com/', 'createdAt': created_at.strftime('%Y-%m-%dT%H:%M:%SZ')}})
+
+        return {
+            'data': {
+                'type': 'match',
+                'id': match_id,
+                'attributes': {
+                    'createdAt': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'duration': rng.randrange(600, 2000),
+                    'gameMode': rng.choice(GAME_MODES),
+                    'matchType': 'official',
+                    'mapName': rng.choice(['Baltic_Main', 'Desert_Main', 'Savage_Main']),
+                    'isCustomMatch': False,
+                    'seasonState': 'progress',
+                    'shardId': 'steam',
+                    'titleId': 'bluehole-pubg',
+                    'stats': None,
+                    'tags': None
+                },
+                'relationships': {
+                    'rosters': {'data': [{'type': 'roster', 'id': r['id']} for r in included if r['type'] == 'roster']},
+                    'assets': {'data': [{'type': 'asset', 'id': included[-1]['id']}]}
+                }
+            },
+            'included': included
+        }
+
+    def game_mode_stats(self, rng):
+        return {field: rng.randrange(1000) for field in SEASON_STATS_FIELDS}
+
+    def season_stats(self, player_id, season_id, game_modes=GAME_MODES):
+        """
+        One player's stats for a season (or 'lifetime'), over the game modes
+        asked for. The player's matches are listed against the season in the
+        matches* relationships, split by game mode as the API does.
+        """
+
+        rng = self.rng('season', player_id, season_id)
+        matches = self.player_matches.get(player_id, []) if season_id in (self.season_ids[-1], 'lifetime') else []
+
+        relationships = {
+            'player': {'data': {'type': 'player', 'id': player_id}},
+            'season': {'data': {'type': 'season', 'id': season_id}}
+        }
+
+        for game_mode in game_modes:
+            key = 'matches' + ''.join(part.capitalize() for part in game_mode.split('-'))
+            relationships[key] = {'data': [{'type': 'match', 'id': m} for m in matches if self.rng('mode', m).choice(GAME_MODES) == game_mode]}
+
+        return {
+            'type': 'playerSeason',
+            'attributes': {
+                'gameModeStats': {game_mode: self.game_mode_stats(rng) for game_mode in game_modes},
+                'bestRankPoint': rng.random() * 3000
+            },
+            'relationships': relationships
+        }
+
+    def ranked_stats(self, player_id, season_id):
+        rng = self.rng('ranked', player_id, season_id)
+
+        # about half the players don't play ranked
+        game_modes = ['squad-fpp'] if rng.random() < 0.5 else []
+        stats = {}
+
+        for game_mode in game_modes:
+            stats[game_mode] = {field: rng.randrange(1000) for field in RANKED_STATS_FIELDS}
+            stats[game_mode]['currentTier'] = {'tier': 'Gold', 'subTier': str(rng.randrange(1, 5))}
+            stats[game_mode]['bestTier'] = {'tier': 'Platinum', 'subTier': str(rng.randrange(1, 5))}
+
+        return {
+            'type': 'rankedplayerstats',
+            'attributes': {'rankedGameModeStats': stats},
+            'relationships': {
+                'player': {'data': {'type': 'player', 'id': player_id}},
+                'season': {'data': {'type': 'season', 'id': season_id}}
+            }
+        }
+
+
+class FakeRateLimiter:
+    """
+    A fixed window of calls per key and per class of endpoint, reported the
+    way the API reports it.
+    """
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, window=DEFAULT_RATE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.windows = {}
+        self.lock = threading.Lock()
+
+        return None
+
+    def take(self, key, endpoint):
+        """
+        Count a call, returning whether it's allowed and the headers to send.
+        """
+
+        now = time.time()
+
+        with self.lock:
+            reset, used = self.windows.get((key, endpoint), (0, 0))
+
+            if now >= reset:
+                reset, used = now + self.window, 0
+
+            allowed = used < self.limit
+            used += 1 if allowed else 0
+            self.windows[(key, endpoint)] = (reset, used)
+
+        headers = {
+            'X-Ratelimit-Limit': str(self.limit),
+            'X-Ratelimit-Remaining': str(max(self.limit - used, 0)),
+            'X-Ratelimit-Reset': str(int(reset))
+        }
+
+        return allowed, headers
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, data, limiter, latency=0.):
+        super().__init__(address, FakeAPIHandler)
+
+        self.data = data
+        self.limiter = limiter
+        self.latency = latency
+
+        # (endpoint class, HTTP status) -> calls
+        self.calls = {}
+        self.calls_lock = threading.Lock()
+
+        return None
+
+    def count(self, endpoint, status):
+        with self.calls_lock:
+            self.calls[(endpoint, status)] = self.calls.get((endpoint, status), 0) + 1
+
+        return None
+
+    def start(self):
+        """
+        Serve on a background thread, returning the base_url to give pubg_api.
+        """
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return 'http://{0}:{1}/shards/'.format(*self.server_address)
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers={}):
+        payload = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/vnd.api+json')
+        self.send_header('Content-Length', str(len(payload)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        endpoint = endpoint_for(url.path)
+
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        headers = {}
+
+        if endpoint != 'matches':
+            allowed, headers = server.limiter.take(self.headers.get('Authorization'), endpoint)
+
+            if not allowed:
+                server.count(endpoint, 429)
+                return self.send_json(429, {'errors': [{'title': 'Too Many Requests'}]}, headers)
+
+        status, body = self.route(url.path, params)
+        server.count(endpoint, status)
+
+        return self.send_json(status, body, headers)
+
+    def route(self, path, params):
+        data = self.server.data
+        not_found = (404, {'errors': [{'title': 'Not Found'}]})
+
+        m = re.match(r'^/shards/[^/]+/matches/([^/]+)$', path)
+        if m:
+            if m.group(1) not in data.match_players:
+                return not_found
+            return 200, data.match(m.group(1))
+
+        if re.match(r'^/shards/[^/]+/players$', path):
+            names = params.get('filter[playerNames]', '').split(',')
+            players = [data.player(name) for name in names if name in data.player_ids]
+            return (200, {'data': players}) if len(players) > 0 else not_found
+
+        if re.match(r'^/shards/[^/]+/seasons$', path):
+            return 200, {'data': data.seasons()}
+
+        m = re.match(r'^/shards/[^/]+/seasons/([^/]+)/gameMode/([^/]+)/players$', path)
+        if m:
+            player_ids = [p for p in params.get('filter[playerIds]', '').split(',') if p in data.names_by_id]
+            return 200, {'data': [data.season_stats(p, m.group(1), [m.group(2)]) for p in player_ids]}
+
+        m = re.match(r'^/shards/[^/]+/players/([^/]+)/seasons/([^/]+)/ranked$', path)
+        if m:
+            if m.group(1) not in data.names_by_id:
+                return not_found
+            return 200, {'data': data.ranked_stats(m.group(1), m.group(2))}
+
+        m = re.match(r'^/shards/[^/]+/players/([^/]+)/seasons/([^/]+)$', path)
+        if m:
+            if m.group(1) not in data.names_by_id:
+                return not_found
+            return 200, {'data': data.season_stats(m.group(1), m.group(2))}
+
+        return not_found
+
+
+@click.command()
+@click.option('--players', default=100, help='Number of players, named player0, player1...')
+@click.option('--matches-per-player', default=20, help='Matches each player has played')
+@click.option('--match-pool', default=None, type=int, help='Number of distinct matches (default players x matches per player)')
+@click.option('--seasons', default=4, help='Number of seasons, the last one current')
+@click.option('--seed', default=0, help='Seed for the generated data')
+@click.option('--rate-limit', default=DEFAULT_RATE_LIMIT, help='Calls per window per key on each rate limited endpoint')
+@click.option('--rate-window', default=DEFAULT_RATE_WINDOW, help='Length of the rate limit window in seconds')
+@click.option('--latency', default=0., help='Seconds to sleep before each response')
+@click.option('--port', default=8080, help='Port to listen on')
+def serve(players, matches_per_player, match_pool, seasons, seed, rate_limit, rate_window, latency, port):
+    """
+    Serve a fake PUBG API until interrupted.
+    """
+
+    data = FakeData(players, matches_per_player, match_pool, seasons, seed)
+    server = FakeAPIServer(('127.0.0.1', port), data, FakeRateLimiter(rate_limit, rate_window), latency)
+
+    print('Serving {0} players and {1} matches at http://127.0.0.1:{2}/shards/'.format(players, len(data.match_ids), port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve()
@@ -3,12 +3,12 @@ Class to manage the connection and transactional functions for the MySQL
 database.
 """
 
-from .model import Player, Match
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import datetime
 from .model import\
-    Player\
+    SystemInformation\
+    , Player\
     , Match\
     , Season\
     , PlayerMatches\
@@ -16,70 +16,289 @@ from .model import\
     , PlayerSeasonStats\
     , PlayerRankedSeasonStats\
     , PlayerLifetimeStats\
-    , PlayerMatchStats
+    , PlayerMatchStats\
+    , FetchLedger\
+    , PlayerWatermark
 from sqlalchemy.dialects.mysql import insert
+from collections import defaultdict
 import logging
 import json
+import time
+import metrics
+from profiling import profiled
+
+# How many rows to send to MySQL in each INSERT ... ON DUPLICATE KEY UPDATE
+DEFAULT_BATCH_SIZE = 1000
+
+def split_included(match):
+    """
+    Splits the included array of a match (participants, rosters and assets
+    all mixed together) into lists by type.
+    """
+
+    included = defaultdict(list)
+
+    for item in match['included']:
+        included[item['type']].append(item)
+
+    return included
+
+def player_match_stats_rows(matches, player_ids):
+    """
+    Builds the player_match_stats rows for a list of matches, for just the
+    participants whose playerId is in the player_ids set. Participants we
+    aren't tracking are skipped, and as the set lookup is O(1) this scales
+    with the number of participants, not participants x tracked players.
+    """
+
+    rows = []
+
+    for match in matches:
+        for participant in split_included(match)['participant']:
+            # this line skips those players who are match participants but not in our tracking list, and
+            # this we don't care about them.
+            if participant['attributes']['stats']['playerId'] not in player_ids:
+                continue
+
+            rows.append(dict(
+                player_id=participant['attributes']['stats']['playerId'],
+                match_id=match['data']['id'],
+                DBNOs=participant['attributes']['stats']['DBNOs'],
+                assists=participant['attributes']['stats']['assists'],
+                boosts=participant['attributes']['stats']['boosts'],
+                damageDealt=participant['attributes']['stats']['damageDealt'],
+                deathType=participant['attributes']['stats']['deathType'],
+                headshotKills=participant['attributes']['stats']['headshotKills'],
+                heals=participant['attributes']['stats']['heals'],
+                killPlace=participant['attributes']['stats']['killPlace'],
+                kills=participant['attributes']['stats']['kills'],
+                longestKill=participant['attributes']['stats']['longestKill'],
+                revives=participant['attributes']['stats']['revives'],
+                rideDistance=participant['attributes']['stats']['rideDistance'],
+                roadKills=participant['attributes']['stats']['roadKills'],
+                swimDistance=participant['attributes']['stats']['swimDistance'],
+                teamKills=participant['attributes']['stats']['teamKills'],
+                timeSurvived=participant['attributes']['stats']['timeSurvived'],
+                vehicleDestroys=participant['attributes']['stats']['vehicleDestroys'],
+                walkDistance=participant['attributes']['stats']['walkDistance'],
+                weaponsAcquired=participant['attributes']['stats']['weaponsAcquired'],
+                winPlace=participant['attributes']['stats']['winPlace']
+            ))
+
+    return rows
 
 class PUBGDatabaseConnector:
 
-    def __init__(self, engine_uri, echo=False):
+    def __init__(self, engine_uri, echo=False, batch_size=DEFAULT_BATCH_SIZE):
         """
         Define connection parameters for the MySQL connection, and that's
         more or less it.
         """
 
-        self.engine = create_engine(engine_uri, echo=echo)
+        # Connections can sit idle between passes in daemon mode for longer
+        # than MySQL's wait_timeout, so they're checked before being reused.
+        self.engine = create_engine(
+            engine_uri,
+            echo=echo,
+            pool_pre_ping=True
+        )
         self.Session = sessionmaker(bind=self.engine)
 
+        self.batch_size = batch_size
+        self.merge_statements = {}
+
+        # The compiled cache for the merge statements alone, so that each is
+        # only compiled the first time it's used, however many batches follow.
+        # It's kept off the engine: there it would hold on to every one-off
+        # statement (and its bound IDs) a daemon ever runs.
+        self.merge_cache = {}
+
         return None
 
+    def merge_statement(self, model):
+        """
+        Returns the INSERT ... ON DUPLICATE KEY UPDATE statement for a table,
+        building it the first time it's asked for. On a duplicate every column
+        outside the primary key is updated; tables that are nothing but a
+        primary key just rewrite it.
+        """
+
+        if model not in self.merge_statements:
+            columns = [c.name for c in model.__table__.columns if not c.primary_key]
+
+            if len(columns) == 0:
+                columns = [c.name for c in model.__table__.columns]
+
+            if self.engine.dialect.name == 'sqlite':
+                # SQLite (only used as a stand-in, by the benchmarks) has no
+                # ON DUPLICATE KEY UPDATE; every upsert here writes whole
+                # rows, so replacing the row comes to the same thing
+                self.merge_statements[model] = model.__table__.insert().prefix_with('OR REPLACE')
+            else:
+                insert_stmt = insert(model)
+
+                self.merge_statements[model] = insert_stmt.on_duplicate_key_update(
+                    **{column: insert_stmt.inserted[column] for column in columns}
+                )
+
+        return self.merge_statements[model]
+
+    @profiled
+    def execute_batched(self, model, rows):
+        """
+        Upserts a list of row dicts into a table, batch_size rows per round
+        trip, inside one transaction. PyMySQL turns each executemany() into a
+        single multi-row INSERT. Returns whether the rows were committed.
+        """
+
+        if len(rows) == 0:
+            return True
+
+        merge_stmt = self.merge_statement(model)
+
+        start = time.perf_counter()
+        conn = self.engine.connect().execution_options(compiled_cache=self.merge_cache)
+        trans = conn.begin()
+        committed = False
+
+        try:
+            for i in range(0, len(rows), self.batch_size):
+                conn.execute(merge_stmt, rows[i:i + self.batch_size])
+            trans.commit()
+            committed = True
+        except Exception as e:
+            logging.exception("execute_batched: Error upserting {0} rows into {1}".format(len(rows), model.__tablename__))
+            trans.rollback()
+
+        conn.close()
+
+        metrics.observe('pubgdb_upsert_seconds', time.perf_counter() - start, table=model.__tablename__)
+
+        if committed:
+            metrics.inc('pubgdb_rows_upserted_total', len(rows), table=model.__tablename__)
+        else:
+            metrics.inc('pubgdb_upsert_failures_total', table=model.__tablename__)
+
+        return committed
+
+    def get_system_information(self, key):
+        """
+        Returns the value stored against a key in system_information, or None
+        if there isn't one.
+        """
+
+        sess = self.Session()
+
+        q = sess.query(SystemInformation).filter_by(key=key).one_or_none()
+
+        sess.close()
+
+        if q is None:
+            return None
+
+        return q.value
+
+    def set_system_information(self, key, value):
+        """
+        Inserts or updates a key in system_information.
+        """
+
+        return self.execute_batched(SystemInformation, [dict(key=key, value=value)])
+
+    @profiled
+    def player_ids(self):
+        """
+        Returns the IDs of every player in the players table.
+        """
+
+        sess = self.Session()
+
+        player_ids = [row.player_id for row in sess.query(Player.player_id)]
+
+        sess.close()
+
+        return player_ids
+
+    @profiled
+    def load_seasons(self):
+        """
+        Returns the seasons held in the DB, in the same shape as the API's
+        /seasons output.
+        """
+
+        sess = self.Session()
+
+        seasons = [
+            {
+                'id': season.season_id,
+                'type': 'season',
+                'attributes': {
+                    'isCurrentSeason': season.is_current_season,
+                    'isOffseason': season.is_off_season
+                }
+            }
+            for season in sess.query(Season).all()
+        ]
+
+        sess.close()
+
+        return seasons
+
+    def season_ended_since(self, since):
+        """
+        Checks whether any match played since the given datetime happened
+        while its season wasn't in progress (the API's seasonState goes to
+        closed and then prepare at the end of a season), which means the
+        current season has probably changed.
+        """
+
+        sess = self.Session()
+
+        q = sess.query(Match).filter(
+            Match.createdAt >= since,
+            Match.seasonState != 'progress'
+        )
+        ended = sess.query(q.exists()).one()[0]
+
+        sess.close()
+
+        return ended
+
+    @profiled
     def upsert_players(self, players):
         """
         Inserts or Updates Players
         """
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
 
         try:
             for player in players:
                 logging.debug("upsert_players: upserting {0}".format(player['attributes']['name']))
-                insert_stmt = insert(Player).values(
+                rows.append(dict(
                     player_id=player['id'],
                     player_name=player['attributes']['name'],
                     shard_id=player['attributes']['shardId']
-                )
-
-                merge_stmt = insert_stmt.on_duplicate_key_update(
-                    player_id=insert_stmt.inserted.player_id,
-                    player_name=insert_stmt.inserted.player_name,
-                    shard_id=insert_stmt.inserted.shard_id,
-                    status='U'
-                )
-
-                conn.execute(merge_stmt)
-            trans.commit()
+                ))
         except Exception as e:
-            trans.rollback()
+            logging.exception("upsert_players: Error reading data from the API output")
 
-        conn.close()
-
-        return True
+        return self.execute_batched(Player, rows)
 
+    @profiled
     def upsert_matches(self, matches):
         """
         Takes matches from the API output and adds them as Match() objects to
         the ORM.
         """
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
+        complete = True
 
-        try:
-            for match in matches:
+        for match in matches:
+            try:
                 match = match['data']
-                insert_stmt = insert(Match).values(
+                rows.append(dict(
                     match_id=match['id'],
                     createdAt=datetime.datetime.strptime(
                         match['attributes']['createdAt'][:-2],
@@ -92,168 +311,79 @@ class PUBGDatabaseConnector:
                     isCustomMatch=match['attributes']['isCustomMatch'],
                     seasonState=match['attributes']['seasonState'],
                     shardId=match['attributes']['shardId']
-                )
+                ))
+            except Exception as e:
+                logging.exception("upsert_matches: Error reading data from the API output")
+                complete = False
 
-                merge_stmt = insert_stmt.on_duplicate_key_update(
-                    match_id=insert_stmt.inserted.match_id,
-                    createdAt=insert_stmt.inserted.createdAt,
-                    duration=insert_stmt.inserted.duration,
-                    gameMode=insert_stmt.inserted.gameMode,
-                    matchType=insert_stmt.inserted.matchType,
-                    mapName=insert_stmt.inserted.mapName,
-                    isCustomMatch=insert_stmt.inserted.isCustomMatch,
-                    seasonState=insert_stmt.inserted.seasonState,
-                    shardId=insert_stmt.inserted.shardId
-                )
+        # the rest are written, but the caller mustn't checkpoint the chunk
+        return self.execute_batched(Match, rows) and complete
 
-                conn.execute(merge_stmt)
-            trans.commit()
-        except:
-            trans.rollback()
-
-        conn.close()
-
-        return True
-
-    def upsert_player_matches(self, players):
+    @profiled
+    def upsert_player_matches(self, players, match_ids=None):
         """
         Drops the link between players and matches into the association table.
+        If match_ids is given, only the links to those matches are written;
+        a link to a match that isn't in the matches table (yet) would fail the
+        foreign key and take the rest of the batch with it.
         """
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
 
         try:
             for player in players:
                 for match in player['relationships']['matches']['data']:
-                    insert_stmt = insert(PlayerMatches).values(
+                    if match_ids is not None and match['id'] not in match_ids:
+                        continue
+
+                    rows.append(dict(
                         player_id=player['id'],
                         match_id=match['id']
-                    )
-
-                    merge_stmt = insert_stmt.on_duplicate_key_update(
-                        player_id=insert_stmt.inserted.player_id,
-                        match_id=insert_stmt.inserted.match_id
-                    )
-
-                    conn.execute(merge_stmt)
-
-            trans.commit()
-        except:
-            trans.rollback()
-
-        conn.close()
+                    ))
+        except Exception as e:
+            logging.exception("upsert_player_matches: Error reading data from the API output")
 
-        return True
+        return self.execute_batched(PlayerMatches, rows)
 
-    def upsert_player_match_stats(self, matches, players):
+    @profiled
+    def upsert_player_match_stats(self, matches, players, player_ids=None):
         """
         Drops in the per-match stats from the matches API endpoint into our
-        DB
+        DB. player_ids adds more players to write the stats of, on top of
+        those in players, for when other sync workers' players may be in the
+        matches too.
         """
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
 
         try:
-            for match in matches:
-                for participant in match['included']:
-                    if participant['type'] != 'participant':
-                        continue
-                    # this line skips those players who are match participants but not in our tracking list, and
-                    # this we don't care about them.
-                    elif participant['attributes']['stats']['playerId'] not in [player['id'] for player in players]:
-                        continue
-                    else:
-                        insert_stmt = insert(PlayerMatchStats).values(
-                            player_id=participant['attributes']['stats']['playerId'],
-                            match_id=match['data']['id'],
-                            DBNOs=participant['attributes']['stats']['DBNOs'],
-                            assists=participant['attributes']['stats']['assists'],
-                            boosts=participant['attributes']['stats']['boosts'],
-                            damageDealt=participant['attributes']['stats']['damageDealt'],
-                            deathType=participant['attributes']['stats']['deathType'],
-                            headshotKills=participant['attributes']['stats']['headshotKills'],
-                            heals=participant['attributes']['stats']['heals'],
-                            killPlace=participant['attributes']['stats']['killPlace'],
-                            kills=participant['attributes']['stats']['kills'],
-                            longestKill=participant['attributes']['stats']['longestKill'],
-                            revives=participant['attributes']['stats']['revives'],
-                            rideDistance=participant['attributes']['stats']['rideDistance'],
-                            roadKills=participant['attributes']['stats']['roadKills'],
-                            swimDistance=participant['attributes']['stats']['swimDistance'],
-                            teamKills=participant['attributes']['stats']['teamKills'],
-                            timeSurvived=participant['attributes']['stats']['timeSurvived'],
-                            vehicleDestroys=participant['attributes']['stats']['vehicleDestroys'],
-                            walkDistance=participant['attributes']['stats']['walkDistance'],
-                            weaponsAcquired=participant['attributes']['stats']['weaponsAcquired'],
-                            winPlace=participant['attributes']['stats']['winPlace']
-                        )
-
-                        merge_stmt = insert_stmt.on_duplicate_key_update(
-                            DBNOs=insert_stmt.inserted.DBNOs,
-                            assists=insert_stmt.inserted.assists,
-                            boosts=insert_stmt.inserted.boosts,
-                            damageDealt=insert_stmt.inserted.damageDealt,
-                            deathType=insert_stmt.inserted.deathType,
-                            headshotKills=insert_stmt.inserted.headshotKills,
-                            heals=insert_stmt.inserted.heals,
-                            killPlace=insert_stmt.inserted.killPlace,
-                            kills=insert_stmt.inserted.kills,
-                            longestKill=insert_stmt.inserted.longestKill,
-                            revives=insert_stmt.inserted.revives,
-                            rideDistance=insert_stmt.inserted.rideDistance,
-                            roadKills=insert_stmt.inserted.roadKills,
-                            swimDistance=insert_stmt.inserted.swimDistance,
-                            teamKills=insert_stmt.inserted.teamKills,
-                            timeSurvived=insert_stmt.inserted.timeSurvived,
-                            vehicleDestroys=insert_stmt.inserted.vehicleDestroys,
-                            walkDistance=insert_stmt.inserted.walkDistance,
-                            weaponsAcquired=insert_stmt.inserted.weaponsAcquired,
-                            winPlace=insert_stmt.inserted.winPlace
-                        )
-
-                        conn.execute(merge_stmt)
-            trans.commit()
+            rows = player_match_stats_rows(matches, {player['id'] for player in players} | set(player_ids or []))
         except Exception as e:
-            print(e)
-            trans.rollback()
-
-        conn.close()
+            logging.exception("upsert_player_match_stats: Error reading data from the API output")
 
-        return True
+        return self.execute_batched(PlayerMatchStats, rows)
 
+    @profiled
     def upsert_seasons(self, seasons):
         """
         Insert season data
         """
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
 
         try:
             for season in seasons:
-                insert_stmt = insert(Season).values(
+                rows.append(dict(
                     season_id=season['id'],
                     is_current_season=season['attributes']['isCurrentSeason'],
                     is_off_season=season['attributes']['isOffseason']
-                )
-
-                merge_stmt = insert_stmt.on_duplicate_key_update(
-                    season_id=insert_stmt.inserted.season_id,
-                    is_current_season=insert_stmt.inserted.is_current_season,
-                    is_off_season=insert_stmt.inserted.is_off_season
-                )
-
-                conn.execute(merge_stmt)
-            trans.commit()
-        except:
-            trans.rollback()
-
-        conn.close()
+                ))
+        except Exception as e:
+            logging.exception("upsert_seasons: Error reading data from the API output")
 
-        return True
+        return self.execute_batched(Season, rows)
 
+    @profiled
     def upsert_season_matches(self, player_season_stats):
         """
         Upserts a list of season IDs and match IDs to work as an association tables
@@ -262,50 +392,38 @@ class PUBGDatabaseConnector:
         last 14 days only, so data is a wee bit sparse.
         """
 
-        conn = self.engine.connect()
+        rows = []
 
         try:
             for player_season in player_season_stats:
                 for relationship in player_season['relationships'].keys():
                     if 'matches' in relationship:
                         for match in player_season['relationships'][relationship]['data']:
-                            trans = conn.begin()
-                            insert_stmt = insert(SeasonMatches).values(
+                            rows.append(dict(
                                 season_id=player_season['relationships']['season']['data']['id'],
                                 match_id=match['id']
-                            )
-
-                            merge_stmt = insert_stmt.on_duplicate_key_update(
-                                season_id=insert_stmt.inserted.season_id,
-                                match_id=insert_stmt.inserted.match_id
-                            )
-
-                            conn.execute(merge_stmt)
-                            trans.commit()
+                            ))
                     else:
                         continue
         except Exception as e:
-            print(e)
-            trans.rollback()
+            logging.exception("upsert_season_matches: Error reading data from the API output")
 
-        conn.close()
-
-        return True
+        return self.execute_batched(SeasonMatches, rows)
 
+    @profiled
     def upsert_player_ranked_season_stats(self, player_ranked_season_stats):
         """
         More irritatingly long-ass sql. Oh well; this is the version of upsert
         player season stats that does the ranked version of the table.
         """
 
-        conn = self.engine.connect()
+        rows = []
+        complete = True
 
         try:
             for player_ranked_season in player_ranked_season_stats:
                 for game_mode in player_ranked_season['attributes']['rankedGameModeStats'].keys():
-                    trans = conn.begin()
-
-                    insert_stmt = insert(PlayerRankedSeasonStats).values(
+                    rows.append(dict(
                         player_id=player_ranked_season['relationships']['player']['data']['id'],
                         season_id=player_ranked_season['relationships']['season']['data']['id'],
                         game_mode=game_mode,
@@ -339,68 +457,30 @@ class PUBGDatabaseConnector:
                         weaponsAcquired=player_ranked_season['attributes']['rankedGameModeStats'][game_mode]['weaponsAcquired'],
                         teamKills=player_ranked_season['attributes']['rankedGameModeStats'][game_mode]['teamKills'],
                         playTime=player_ranked_season['attributes']['rankedGameModeStats'][game_mode]['playTime'],
-                        killStreak=player_ranked_season['attributes']['rankedGameModeStats'][game_mode]['killStreak'],
-                    )
-
-                    merge_stmt = insert_stmt.on_duplicate_key_update(
-                        currentRankPoint=insert_stmt.inserted.currentRankPoint,
-                        bestRankPoint=insert_stmt.inserted.bestRankPoint,
-                        currentTier_Tier=insert_stmt.inserted.currentTier_Tier,
-                        currentTier_subTier=insert_stmt.inserted.currentTier_subTier,
-                        bestTier_Tier=insert_stmt.inserted.bestTier_Tier,
-                        bestTier_subTier=insert_stmt.inserted.bestTier_subTier,
-                        roundsPlayed=insert_stmt.inserted.roundsPlayed,
-                        avgRank=insert_stmt.inserted.avgRank,
-                        avgSurvivalTime=insert_stmt.inserted.avgSurvivalTime,
-                        top10Ratio=insert_stmt.inserted.top10Ratio,
-                        winRatio=insert_stmt.inserted.winRatio,
-                        assists=insert_stmt.inserted.assists,
-                        wins=insert_stmt.inserted.wins,
-                        kda=insert_stmt.inserted.kda,
-                        kdr=insert_stmt.inserted.kdr,
-                        kills=insert_stmt.inserted.kills,
-                        deaths=insert_stmt.inserted.deaths,
-                        roundMostKills=insert_stmt.inserted.roundMostKills,
-                        longestKill=insert_stmt.inserted.longestKill,
-                        headshotKills=insert_stmt.inserted.headshotKills,
-                        headshotKillRatio=insert_stmt.inserted.headshotKillRatio,
-                        damageDealt=insert_stmt.inserted.damageDealt,
-                        dBNOs=insert_stmt.inserted.dBNOs,
-                        reviveRatio=insert_stmt.inserted.reviveRatio,
-                        revives=insert_stmt.inserted.revives,
-                        heals=insert_stmt.inserted.heals,
-                        boosts=insert_stmt.inserted.boosts,
-                        weaponsAcquired=insert_stmt.inserted.weaponsAcquired,
-                        teamKills=insert_stmt.inserted.teamKills,
-                        playTime=insert_stmt.inserted.playTime,
-                        killStreak=insert_stmt.inserted.killStreak,
-                    )
-
-                    conn.execute(merge_stmt)
-                    trans.commit()
-                    
+                        killStreak=player_ranked_season['attributes']['rankedGameModeStats'][game_mode]['killStreak']
+                    ))
         except Exception as e:
             logging.error("Content of player_ranked_season_stats: {0}".format(json.dumps(player_ranked_season_stats, indent=4)))
             logging.error("Exception Details: {0}".format(e))
-            trans.rollback()
+            complete = False
 
-        conn.close()
-
-        return True
+        # nothing's checkpointed off the back of a record we couldn't read
+        return self.execute_batched(PlayerRankedSeasonStats, rows) and complete
 
+    @profiled
     def upsert_player_season_stats(self, player_season_stats):
         """
         The SQL Statement here is irritatingly long-ass but it's a big table
         and I don't know how else to let the upsert do its thing so "ASCII SHRUG".
         """
 
-        conn = self.engine.connect()
+        rows = []
+        complete = True
 
         try:
             for player_season in player_season_stats:
                 for game_mode in player_season['attributes']['gameModeStats'].keys():
-                    trans = conn.begin()
-                    insert_stmt = insert(PlayerSeasonStats).values(
+                    rows.append(dict(
                         player_id=player_season['relationships']['player']['data']['id'],
                         season_id=player_season['relationships']['season']['data']['id'],
                         game_mode=game_mode,
@@ -438,63 +518,24 @@ class PUBGDatabaseConnector:
                         weeklyWins=player_season['attributes']['gameModeStats'][game_mode]['weeklyWins'],
                         winPoints=player_season['attributes']['gameModeStats'][game_mode]['winPoints'],
                         wins=player_season['attributes']['gameModeStats'][game_mode]['wins']
-                    )
-
-                    merge_stmt = insert_stmt.on_duplicate_key_update(
-                        assists=insert_stmt.inserted.assists,
-                        boosts=insert_stmt.inserted.boosts,
-                        dBNOs=insert_stmt.inserted.dBNOs,
-                        dailyKills=insert_stmt.inserted.dailyKills,
-                        damageDealt=insert_stmt.inserted.damageDealt,
-                        days=insert_stmt.inserted.days,
-                        dailyWins=insert_stmt.inserted.dailyWins,
-                        headshotKills=insert_stmt.inserted.headshotKills,
-                        heals=insert_stmt.inserted.heals,
-                        killPoints=insert_stmt.inserted.killPoints,
-                        kills=insert_stmt.inserted.kills,
-                        longestKill=insert_stmt.inserted.longestKill,
-                        longestTimeSurvived=insert_stmt.inserted.longestTimeSurvived,
-                        losses=insert_stmt.inserted.losses,
-                        maxKillStreaks=insert_stmt.inserted.maxKillStreaks,
-                        mostSurvivalTime=insert_stmt.inserted.mostSurvivalTime,
-                        rankPoints=insert_stmt.inserted.rankPoints,
-                        revives=insert_stmt.inserted.revives,
-                        rideDistance=insert_stmt.inserted.rideDistance,
-                        roadKills=insert_stmt.inserted.roadKills,
-                        roundMostKills=insert_stmt.inserted.roundMostKills,
-                        roundsPlayed=insert_stmt.inserted.roundsPlayed,
-                        suicides=insert_stmt.inserted.suicides,
-                        swimDistance=insert_stmt.inserted.swimDistance,
-                        teamKills=insert_stmt.inserted.teamKills,
-                        timeSurvived=insert_stmt.inserted.timeSurvived,
-                        top10s=insert_stmt.inserted.top10s,
-                        vehicleDestroys=insert_stmt.inserted.vehicleDestroys,
-                        walkDistance=insert_stmt.inserted.walkDistance,
-                        weaponsAcquired=insert_stmt.inserted.weaponsAcquired,
-                        weeklyKills=insert_stmt.inserted.weeklyKills,
-                        weeklyWins=insert_stmt.inserted.weeklyWins,
-                        winPoints=insert_stmt.inserted.winPoints,
-                        wins=insert_stmt.inserted.wins
-                    )
-
-                    conn.execute(merge_stmt)
-                    trans.commit()
+                    ))
         except Exception as e:
-            trans.rollback()
-
-        conn.close()
+            logging.exception("upsert_player_season_stats: Error reading data from the API output")
+            complete = False
 
-        return True
+        # nothing's checkpointed off the back of a record we couldn't read
+        return self.execute_batched(PlayerSeasonStats, rows) and complete
 
+    @profiled
     def upsert_player_lifetime_stats(self, player_lifetime_stats):
 
-        conn = self.engine.connect()
-        trans = conn.begin()
+        rows = []
+        complete = True
 
         try:
             for lifetime_stats in player_lifetime_stats:
                 for game_mode in lifetime_stats['attributes']['gameModeStats'].keys():
-                    insert_stmt = insert(PlayerLifetimeStats).values(
+                    rows.append(dict(
                         player_id=lifetime_stats['relationships']['player']['data']['id'],
                         game_mode=game_mode,
                         assists=lifetime_stats['attributes']['gameModeStats'][game_mode]['assists'],
@@ -531,51 +572,26 @@ class PUBGDatabaseConnector:
                         weeklyWins=lifetime_stats['attributes']['gameModeStats'][game_mode]['weeklyWins'],
                         winPoints=lifetime_stats['attributes']['gameModeStats'][game_mode]['winPoints'],
                         wins=lifetime_stats['attributes']['gameModeStats'][game_mode]['wins']
-                    )
-
-                    merge_stmt = insert_stmt.on_duplicate_key_update(
-                        game_mode=insert_stmt.inserted.game_mode,
-                        assists=insert_stmt.inserted.assists,
-                        boost=insert_stmt.inserted.boosts,
-                        dBNOs=insert_stmt.inserted.dBNOs,
-                        dailyKills=insert_stmt.inserted.dailyKills,
-                        damageDealt=insert_stmt.inserted.damageDealt,
-                        days=insert_stmt.inserted.days,
-                        dailyWins=insert_stmt.inserted.dailyWins,
-                        headshotKills=insert_stmt.inserted.headshotKills,
-                        heals=insert_stmt.inserted.heals,
-                        killPoints=insert_stmt.inserted.killPoints,
-                        kills=insert_stmt.inserted.kills,
-                        longestKill=insert_stmt.inserted.longestKill,
-                        longestTimeSurvived=insert_stmt.inserted.longestTimeSurvived,
-                        losses=insert_stmt.inserted.losses,
-                        maxKillStreaks=insert_stmt.inserted.maxKillStreaks,
-                        mostSurvivalTime=insert_stmt.inserted.mostSurvivalTime,
-                        rankPoints=insert_stmt.inserted.rankPoints,
-                        revives=insert_stmt.inserted.revives,
-                        rideDistance=insert_stmt.inserted.rideDistance,
-                        roadKills=insert_stmt.inserted.roadKills,
-                        roundMostKills=insert_stmt.inserted.roundMostKills,
-                        roundsPlayed=insert_stmt.inserted.roundsPlayed,
-                        suicides=insert_stmt.inserted.suicides,
-                        swimDistance=insert_stmt.inserted.swimDistance,
-                        teamKills=insert_stmt.inserted.teamKills,
-                        timeSurvived=insert_stmt.inserted.timeSurvived,
-                        top10s=insert_stmt.inserted.top10s,
-                        vehicleDestroys=insert_stmt.inserted.vehicleDestroys,
-                        walkDistance=insert_stmt.inserted.walkDistance,
-                        weaponsAcquired=insert_stmt.inserted.weaponsAcquired,
-                        weeklyKills=insert_stmt.inserted.weeklyKills,
-                        weeklyWins=insert_stmt.inserted.weeklyWins,
-                        winPoints=insert_stmt.inserted.winPoints,
-                        wins=insert_stmt.inserted.wins
-                    )
-
-                    conn.execute(merge_stmt)
-            trans.commit()
+                    ))
         except Exception as e:
-            trans.rollback()
+            logging.exception("upsert_player_lifetime_stats: Error reading data from the API output")
+            complete = False
 
-        conn.close()
+        # nothing's checkpointed off the back of a record we couldn't read
+        return self.execute_batched(PlayerLifetimeStats, rows) and complete
+
+    @profiled
+    def upsert_fetch_ledger(self, fetch_ledger):
+        """
+        Records the outcome of each stats fetch, see pubg_api.record_fetch.
+        """
+
+        return self.execute_batched(FetchLedger, fetch_ledger)
+
+    @profiled
+    def upsert_player_watermarks(self, watermarks):
+        """
+        Moves the players' watermarks on, see SyncPlanner.watermarks.
+        """
 
-        return True
+        return self.execute_batched(PlayerWatermark, watermarks)
@@ -0,0 +1,281 @@
+"""
+Coordination between several sync workers sharing one database. The players
+are split into hash partitions and each partition is leased to one worker at
+a time, kept alive by a heartbeat; a worker that dies stops heartbeating and
+its partitions are taken over (and their runs resumed) by the others. Matches
+are claimed before they're fetched, so one played by players in different
+partitions is only fetched once.
+
+Every time here comes from the DB's clock, so that the hosts' clocks don't
+have to agree.
+"""
+
+import datetime
+import logging
+import threading
+import zlib
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.dialects.mysql import insert
+from .model import\
+    SyncLease\
+    , MatchClaim
+from .planner import chunks
+from profiling import profiled
+
+# How long a lease survives without a heartbeat, and how often the heartbeat
+# goes out
+LEASE_TIMEOUT = 120
+HEARTBEAT_INTERVAL = 30
+
+# How long a match claim stands before another worker may take it over. It
+# only needs to cover the time from claiming a match to writing it.
+CLAIM_TIMEOUT = 3600
+
+# Claims older than this are of no more use and are cleared out
+CLAIM_RETENTION = datetime.timedelta(days=1)
+
+
+def partition_for(player_name, partitions):
+    """
+    The partition a player belongs to. crc32 rather than hash() so that every
+    worker, whatever its Python, agrees.
+    """
+
+    return zlib.crc32(player_name.lower().encode('utf-8')) % partitions
+
+
+def db_now(conn):
+    """
+    The DB's idea of the time now, in UTC.
+    """
+
+    return conn.execute(select([func.utc_timestamp()])).scalar()
+
+
+class PartitionLeases:
+
+    def __init__(self, pubgdb, partitions, worker_id):
+        """
+        pubgdb is the PUBGDatabaseConnector shared by the workers, partitions
+        how many partitions the players are split into (which every worker
+        must agree on) and worker_id a name unique to this worker.
+        """
+
+        self.pubgdb = pubgdb
+        self.partitions = partitions
+        self.worker_id = worker_id
+
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+        # every partition gets a row up front, so that acquiring one is
+        # always a single conditional UPDATE
+        conn = self.pubgdb.engine.connect()
+        conn.execute(
+            insert(SyncLease.__table__).prefix_with('IGNORE'),
+            [dict(partition_id=p) for p in range(partitions)]
+        )
+        conn.close()
+
+        return None
+
+    def acquire(self, partition_id, since):
+        """
+        Tries to take the lease on a partition that hasn't finished a pass
+        since `since` (a DB time). It can be taken if nobody holds it, if we
+        already do, or if its holder's heartbeat has gone stale. Returns
+        whether we got it.
+        """
+
+        table = SyncLease.__table__
+        conn = self.pubgdb.engine.connect()
+        now = db_now(conn)
+
+        result = conn.execute(
+            table.update().where(and_(
+                table.c.partition_id == partition_id,
+                or_(
+                    table.c.worker_id == None,
+                    table.c.worker_id == self.worker_id,
+                    table.c.heartbeat_at < now - datetime.timedelta(seconds=LEASE_TIMEOUT)
+                ),
+                or_(table.c.synced_at == None, table.c.synced_at < since)
+            )).values(worker_id=self.worker_id, heartbeat_at=now)
+        )
+        conn.close()
+
+        if result.rowcount == 0:
+            return False
+
+        with self.lock:
+            self.held.add(partition_id)
+
+        logging.info("PartitionLeases.acquire: {0} took partition {1}".format(self.worker_id, partition_id))
+
+        return True
+
+    def release(self, partition_id, synced):
+        """
+        Gives up a partition's lease, marking it as synced if its pass
+        finished.
+        """
+
+        with self.lock:
+            self.held.discard(partition_id)
+
+        table = SyncLease.__table__
+        conn = self.pubgdb.engine.connect()
+        values = dict(worker_id=None, heartbeat_at=None)
+
+        if synced:
+            values['synced_at'] = db_now(conn)
+
+        conn.execute(
+            table.update().where(and_(
+                table.c.partition_id == partition_id,
+                table.c.worker_id == self.worker_id
+            )).values(**values)
+        )
+        conn.close()
+
+        return None
+
+    def due(self):
+        """
+        Generator over the partitions this worker gets to sync this pass. It
+        goes round all of them, starting from a place that depends on the
+        worker so the workers don't all fight over the same ones, and hands
+        out each that it can lease and that nobody has finished since the
+        pass began. The heartbeat runs for as long as the generator does, and
+        each lease is released once the caller moves on (as synced, unless
+        the caller's work raised).
+        """
+
+        conn = self.pubgdb.engine.connect()
+        since = db_now(conn)
+        conn.close()
+
+        start = zlib.crc32(self.worker_id.encode('utf-8')) % self.partitions
+
+        self.start_heartbeat()
+
+        try:
+            for i in range(self.partitions):
+                partition_id = (start + i) % self.partitions
+
+                if not self.acquire(partition_id, since):
+                    continue
+
+                synced = False
+
+                try:
+                    yield partition_id
+                    synced = True
+                finally:
+                    self.release(partition_id, synced)
+        finally:
+            self.stop_heartbeat()
+
+        return None
+
+    def start_heartbeat(self):
+        self.stopped.clear()
+        self.heartbeat = threading.Thread(target=self.beat, daemon=True)
+        self.heartbeat.start()
+
+        return None
+
+    def stop_heartbeat(self):
+        self.stopped.set()
+        self.heartbeat.join()
+
+        return None
+
+    def beat(self):
+        """
+        Keeps the leases we hold alive until told to stop. If one has been
+        taken over (we went too long without a heartbeat) there's nothing to
+        be done but say so: the writes are all upserts, so two workers on one
+        partition only waste calls.
+        """
+
+        table = SyncLease.__table__
+
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            with self.lock:
+                held = list(self.held)
+
+            if len(held) == 0:
+                continue
+
+            try:
+                conn = self.pubgdb.engine.connect()
+                result = conn.execute(
+                    table.update().where(and_(
+                        table.c.partition_id.in_(held),
+                        table.c.worker_id == self.worker_id
+                    )).values(heartbeat_at=db_now(conn))
+                )
+                conn.close()
+
+                if result.rowcount < len(held):
+                    logging.warning("PartitionLeases.beat: {0} has lost the lease on some of partitions {1}".format(self.worker_id, held))
+            except Exception as e:
+                logging.exception("PartitionLeases.beat: Error renewing leases")
+
+        return None
+
+
+class MatchClaims:
+
+    def __init__(self, pubgdb, worker_id):
+        self.pubgdb = pubgdb
+        self.worker_id = worker_id
+
+        return None
+
+    @profiled
+    def claim(self, match_ids):
+        """
+        Claims as many of the matches as we can and returns the IDs of those
+        that are ours to fetch: any nobody had claimed, any we'd claimed
+        already, and any whose claim has gone stale.
+        """
+
+        table = MatchClaim.__table__
+        conn = self.pubgdb.engine.connect()
+        now = db_now(conn)
+        mine = []
+
+        conn.execute(table.delete().where(table.c.claimed_at < now - CLAIM_RETENTION))
+
+        for chunk in chunks(match_ids):
+            conn.execute(
+                insert(table).prefix_with('IGNORE'),
+                [dict(match_id=match_id, worker_id=self.worker_id, claimed_at=now) for match_id in chunk]
+            )
+
+            conn.execute(
+                table.update().where(and_(
+                    table.c.match_id.in_(chunk),
+                    table.c.worker_id != self.worker_id,
+                    table.c.claimed_at < now - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+                )).values(worker_id=self.worker_id, claimed_at=now)
+            )
+
+            mine += [
+                row.match_id for row in conn.execute(
+                    select([table.c.match_id]).where(and_(
+                        table.c.match_id.in_(chunk),
+                        table.c.worker_id == self.worker_id
+                    ))
+                )
+            ]
+
+        conn.close()
+
+        logging.info("MatchClaims.claim: {0} of {1} matches are ours to fetch".format(len(mine), len(match_ids)))
+
+        return mine
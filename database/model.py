@@ -6,8 +6,10 @@ from sqlalchemy import \
     , String\
     , Boolean\
     , DateTime\
+    , Date\
     , ForeignKey\
-    , Table
+    , Table\
+    , Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import PrimaryKeyConstraint
 
@@ -35,7 +37,7 @@ class PlayerMatches(Base):
     player_id = Column(String(256), ForeignKey('players.player_id'), primary_key=True)
     player = relationship("Player", back_populates='matches')
 
-    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True)
+    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True, index=True)
     match = relationship("Match", back_populates="players")
 
     def __repr__(self):
@@ -51,7 +53,7 @@ class SeasonMatches(Base):
     season_id = Column(String(256), ForeignKey('seasons.season_id'), primary_key=True)
     season = relationship('Season', back_populates='matches')
 
-    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True)
+    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True, index=True)
     match = relationship('Match', back_populates='season')
 
     def __repr__(self):
@@ -144,6 +146,13 @@ class Match(Base):
     seasonState = Column(String(256), nullable=False)
     shardId = Column(String(256), nullable=False)
 
+    # for the date range queries, covering the columns the dashboards group
+    # by; the PK (match_id) comes along in every InnoDB index
+    __table_args__ = (
+        Index('ix_matches_createdAt', 'createdAt', 'gameMode', 'mapName'),
+        {},
+    )
+
     players = relationship(
         'PlayerMatches',
         back_populates='match'
@@ -170,7 +179,7 @@ class PlayerMatchStats(Base):
 
     player_id = Column(String(256), primary_key=True)
 
-    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True)
+    match_id = Column(String(256), ForeignKey('matches.match_id'), primary_key=True, index=True)
 
     DBNOs = Column(Integer, nullable=False)
     assists = Column(Integer, nullable=False)
@@ -199,6 +208,51 @@ class PlayerMatchStats(Base):
             self.match_id
         )
 
+class PlayerDailyStats(Base):
+    """
+    Rollup of player_match_stats joined to matches, one row per player, day
+    (UTC), game mode and map, for the dashboards to read instead of scanning
+    every match. Kept up to date by database/rollups.py as the matches are
+    written.
+    """
+
+    __tablename__ = 'player_daily_stats'
+
+    player_id = Column(String(256))
+    day = Column(Date)
+    # short enough that the PK fits InnoDB's 3072 byte limit under utf8mb4
+    game_mode = Column(String(64))
+    map_name = Column(String(64))
+
+    matches = Column(Integer, nullable=False)
+    wins = Column(Integer, nullable=False)
+    top10s = Column(Integer, nullable=False)
+    kills = Column(Integer, nullable=False)
+    assists = Column(Integer, nullable=False)
+    DBNOs = Column(Integer, nullable=False)
+    headshotKills = Column(Integer, nullable=False)
+    revives = Column(Integer, nullable=False)
+    damageDealt = Column(Float, nullable=False)
+    longestKill = Column(Float, nullable=False)
+    timeSurvived = Column(Float, nullable=False)
+    walkDistance = Column(Float, nullable=False)
+    rideDistance = Column(Float, nullable=False)
+
+    # have to move the PK definition to table args or SQL Alchemy only seems
+    # to keep the first two.
+    __table_args__ = (
+        PrimaryKeyConstraint('player_id', 'day', 'game_mode', 'map_name'),
+        {},
+    )
+
+    def __repr__(self):
+        return "<PlayerDailyStats(player_id={0}, day={1}, game_mode={2}, map_name={3})>".format(
+            self.player_id,
+            self.day,
+            self.game_mode,
+            self.map_name
+        )
+
 class PlayerSeasonStats(Base):
     """
     Stats for a single season, per player and game mode. I.E. there's a row for
@@ -382,3 +436,154 @@ class PlayerLifetimeStats(Base):
             self.player_id,
             self.game_mode
         )
+
+class FetchLedger(Base):
+    """
+    A record of the last stats fetch for each endpoint, player and season,
+    whatever came back - including empty results and 404s, which otherwise
+    leave nothing behind in the stats tables. Stats for an expired season
+    can't change, so once a fetch for one is recorded here it isn't made
+    again.
+    """
+
+    __tablename__ = 'fetch_ledger'
+
+    endpoint = Column(String(64), nullable=False)
+    player_id = Column(String(256), nullable=False)
+    season_id = Column(String(256), nullable=False)
+    status = Column(String(64), nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return "<FetchLedger(endpoint={0}, player_id={1}, season_id={2}, status={3})>".format(
+            self.endpoint,
+            self.player_id,
+            self.season_id,
+            self.status
+        )
+
+    # have to move the PK definition to table args or SQL Alchemy only seems
+    # to keep the first two.
+    __table_args__ = (
+        PrimaryKeyConstraint('endpoint', 'player_id', 'season_id'),
+        {},
+    )
+
+class PlayerWatermark(Base):
+    """
+    How far each player's data has been synced: the newest match of theirs
+    we've seen (with its createdAt, which is UTC as it comes from the API)
+    and when their season and lifetime stats were last written. Only moved on
+    once the stats have been committed.
+    """
+
+    __tablename__ = 'player_watermarks'
+
+    player_id = Column(String(256), ForeignKey('players.player_id'), primary_key=True)
+    last_match_id = Column(String(256), nullable=True)
+    last_match_createdAt = Column(DateTime, nullable=True)
+    last_stats_refresh = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return "<PlayerWatermark(player_id={0}, last_match_createdAt={1})>".format(
+            self.player_id,
+            self.last_match_createdAt
+        )
+
+class SyncRun(Base):
+    """
+    One row per sync run: the partition of the players it covered (always 0
+    unless the players are split between workers), when it started and
+    finished, the phase it last reached, and whether it's still 'running',
+    'complete' or was 'abandoned' by a later run starting afresh. A run left
+    'running' is one that died, and can be picked up again with --resume.
+    """
+
+    __tablename__ = 'sync_runs'
+
+    run_id = Column(Integer, primary_key=True, autoincrement=True)
+    partition_id = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    phase = Column(String(64), nullable=False)
+    status = Column(String(64), nullable=False)
+
+    def __repr__(self):
+        return "<SyncRun(run_id={0}, phase={1}, status={2})>".format(
+            self.run_id,
+            self.phase,
+            self.status
+        )
+
+class SyncRunItem(Base):
+    """
+    The items a sync run has finished with inside its long phases - match IDs
+    written, (player, season) stats fetched and written - along with how the
+    fetch went. Only kept until the run completes.
+    """
+
+    __tablename__ = 'sync_run_items'
+
+    run_id = Column(Integer, ForeignKey('sync_runs.run_id'), nullable=False)
+    phase = Column(String(64), nullable=False)
+    item_key = Column(String(512), nullable=False)
+    status = Column(String(64), nullable=False)
+
+    def __repr__(self):
+        return "<SyncRunItem(run_id={0}, phase={1}, item_key={2}, status={3})>".format(
+            self.run_id,
+            self.phase,
+            self.item_key,
+            self.status
+        )
+
+    # have to move the PK definition to table args or SQL Alchemy only seems
+    # to keep the first two.
+    __table_args__ = (
+        PrimaryKeyConstraint('run_id', 'phase', 'item_key'),
+        {},
+    )
+
+class SyncLease(Base):
+    """
+    When the players are split into hash partitions between several sync
+    workers, who holds each partition. A lease is held for as long as its
+    worker keeps the heartbeat going; once that goes stale any worker can
+    take the partition over. synced_at is when the partition last finished a
+    pass. The times come from the DB's clock, so that the workers' clocks
+    don't need to agree.
+    """
+
+    __tablename__ = 'sync_leases'
+
+    partition_id = Column(Integer, primary_key=True, autoincrement=False)
+    worker_id = Column(String(256), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    synced_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return "<SyncLease(partition_id={0}, worker_id={1}, heartbeat_at={2})>".format(
+            self.partition_id,
+            self.worker_id,
+            self.heartbeat_at
+        )
+
+class MatchClaim(Base):
+    """
+    Which sync worker has claimed the fetching of each match, so that a match
+    played by players in different partitions is only fetched once. A claim
+    that's been around too long without the match being written is assumed
+    dead and can be taken over.
+    """
+
+    __tablename__ = 'match_claims'
+
+    match_id = Column(String(256), primary_key=True)
+    worker_id = Column(String(256), nullable=False)
+    claimed_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return "<MatchClaim(match_id={0}, worker_id={1})>".format(
+            self.match_id,
+            self.worker_id
+        )
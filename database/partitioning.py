@@ -0,0 +1,110 @@
+"""
+Optional RANGE partitioning of the matches table by month (MySQL only), so
+that queries over a range of dates only touch the months in it and old
+months can be dropped or archived a partition at a time.
+
+MySQL has two rules that shape this. Every unique key of a partitioned table
+has to include the partitioning column, so the primary key becomes
+(match_id, createdAt); and partitioned InnoDB tables can't take part in
+foreign keys, so the foreign keys onto matches from player_matches,
+season_matches and player_match_stats are dropped (their match_id indexes
+stay). The sync never relied on them, it writes matches before anything that
+points at them.
+
+player_match_stats isn't partitioned: it has no date of its own to partition
+by.
+"""
+
+import datetime
+import logging
+from sqlalchemy import inspect, text
+
+# The tables with foreign keys onto matches.match_id
+REFERENCING_TABLES = ('player_matches', 'season_matches', 'player_match_stats')
+
+# How many months past the current one get partitions up front. Matches from
+# after that go into the catch-all pmax partition until it's split with
+# ALTER TABLE matches REORGANIZE PARTITION pmax INTO (...).
+MONTHS_AHEAD = 12
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_definitions(first, last):
+    """
+    One partition per month from the month of first to the month of last,
+    each named pYYYYMM and holding the dates before the next month's start.
+    """
+
+    definitions = []
+    month = month_start(first)
+
+    while month <= last:
+        definitions.append("PARTITION p{0:%Y%m} VALUES LESS THAN (TO_DAYS('{1:%Y-%m-%d}'))".format(month, next_month(month)))
+        month = next_month(month)
+
+    return definitions
+
+
+def is_partitioned(conn):
+    return conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'matches' AND PARTITION_NAME IS NOT NULL"
+    )).scalar() > 0
+
+
+def partition_matches(conn):
+    """
+    Partition matches by month, from its oldest match to MONTHS_AHEAD months
+    from now, with a pmax partition for anything later.
+    """
+
+    if is_partitioned(conn):
+        return None
+
+    inspector = inspect(conn)
+
+    for table in REFERENCING_TABLES:
+        for fk in inspector.get_foreign_keys(table):
+            if fk['referred_table'] == 'matches':
+                conn.execute(text("ALTER TABLE {0} DROP FOREIGN KEY {1}".format(table, fk['name'])))
+
+    first = conn.execute(text("SELECT MIN(createdAt) FROM matches")).scalar() or datetime.date.today()
+    last = datetime.date.today()
+
+    for i in range(MONTHS_AHEAD):
+        last = next_month(last)
+
+    definitions = partition_definitions(first, last) + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+
+    conn.execute(text("ALTER TABLE matches DROP PRIMARY KEY, ADD PRIMARY KEY (match_id, createdAt)"))
+    conn.execute(text(
+        "ALTER TABLE matches PARTITION BY RANGE (TO_DAYS(createdAt)) ({0})".format(', '.join(definitions))
+    ))
+
+    logging.info("partition_matches: Partitioned matches into {0} months".format(len(definitions) - 1))
+
+    return None
+
+
+def unpartition_matches(conn):
+    """
+    Undo partition_matches.
+    """
+
+    if not is_partitioned(conn):
+        return None
+
+    conn.execute(text("ALTER TABLE matches REMOVE PARTITIONING"))
+    conn.execute(text("ALTER TABLE matches DROP PRIMARY KEY, ADD PRIMARY KEY (match_id)"))
+
+    for table in REFERENCING_TABLES:
+        conn.execute(text("ALTER TABLE {0} ADD FOREIGN KEY (match_id) REFERENCES matches (match_id)".format(table)))
+
+    return None
@@ -0,0 +1,234 @@
+"""
+Works out what a sync run needs to fetch from the API. Rather than asking the
+database about one player, match or season at a time, it loads the keys that
+already exist with a few bulk IN (...) queries and does the rest against sets.
+"""
+
+import time
+import datetime
+import logging
+from profiling import profiled
+from .model import\
+    Match\
+    , PlayerMatchStats\
+    , PlayerSeasonStats\
+    , PlayerRankedSeasonStats\
+    , FetchLedger\
+    , PlayerWatermark
+
+# How many keys to put in a single IN (...) list
+IN_CHUNK_SIZE = 1000
+
+# Fetch ledger statuses that are final for an expired season: we either got
+# the stats or the API told us there aren't any
+SETTLED_STATUSES = ('ok', 'empty', '404')
+
+
+def chunks(items, size=IN_CHUNK_SIZE):
+    """
+    Split a list into lists of at most size items.
+    """
+
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class SyncPlanner:
+
+    def __init__(self, pubgdb):
+        """
+        pubgdb is the PUBGDatabaseConnector to plan against. The time spent
+        planning is added up in self.elapsed.
+        """
+
+        self.pubgdb = pubgdb
+        self.elapsed = 0.
+        self.newest_matches = {}
+        self.known_matches = set()
+
+        return None
+
+    @profiled
+    def matches_to_fetch(self, players):
+        """
+        Returns the IDs of the matches that need fetching: every match one of
+        the players has played for which we don't hold that player's stats yet,
+        each listed once, leaving out any the API has said it doesn't have.
+        """
+
+        start = time.perf_counter()
+
+        match_ids = list({m['id'] for p in players for m in p['relationships']['matches']['data']})
+        existing = set()
+        missing = set()
+
+        sess = self.pubgdb.Session()
+
+        for chunk in chunks(match_ids):
+            existing.update(
+                (row.player_id, row.match_id) for row in sess.query(
+                    PlayerMatchStats.player_id,
+                    PlayerMatchStats.match_id
+                ).filter(PlayerMatchStats.match_id.in_(chunk))
+            )
+
+            # matches the API has told us it doesn't have
+            missing.update(
+                row.player_id for row in sess.query(FetchLedger.player_id).filter(
+                    FetchLedger.endpoint == 'match',
+                    FetchLedger.status == '404',
+                    FetchLedger.player_id.in_(chunk)
+                )
+            )
+
+        sess.close()
+
+        process_matches = []
+        seen = set()
+
+        for player in players:
+            for match in player['relationships']['matches']['data']:
+                # If we already added it, or it already exists in the database
+                if (match['id'] in seen) or (match['id'] in missing) or ((player['id'], match['id']) in existing):
+                    continue
+                else:
+                    seen.add(match['id'])
+                    process_matches.append(match['id'])
+
+        self.elapsed += time.perf_counter() - start
+        logging.debug("matches_to_fetch: {0} matches to fetch".format(len(process_matches)))
+
+        return process_matches
+
+    @profiled
+    def players_to_process(self, players):
+        """
+        Returns the IDs of the players whose stats need refreshing: those with
+        no watermark yet (new players, or stats that never got written) and
+        those whose most recent match in the API output is newer than their
+        watermark. Only the matches in the API output are looked up, so this
+        costs the same however much history the database holds.
+
+        The newest match seen for each player is kept in self.newest_matches,
+        ready for advancing the watermarks once their stats are written, and
+        the IDs of the matches in the API output that the matches table holds
+        in self.known_matches.
+        """
+
+        start = time.perf_counter()
+
+        player_ids = [p['id'] for p in players]
+        match_ids = list({m['id'] for p in players for m in p['relationships']['matches']['data']})
+        match_datetimes = {}
+        watermarks = {}
+
+        sess = self.pubgdb.Session()
+
+        for chunk in chunks(match_ids):
+            match_datetimes.update(
+                (row.match_id, row.createdAt) for row in sess.query(
+                    Match.match_id,
+                    Match.createdAt
+                ).filter(Match.match_id.in_(chunk))
+            )
+
+        for chunk in chunks(player_ids):
+            watermarks.update(
+                (row.player_id, row) for row in sess.query(PlayerWatermark).filter(PlayerWatermark.player_id.in_(chunk))
+            )
+
+        sess.close()
+
+        self.known_matches = set(match_datetimes)
+        process_players = []
+
+        for player in players:
+            played = [(match_datetimes[m['id']], m['id']) for m in player['relationships']['matches']['data'] if m['id'] in match_datetimes]
+            watermark = watermarks.get(player['id'])
+
+            if len(played) > 0:
+                self.newest_matches[player['id']] = max(played)
+            elif watermark is not None and watermark.last_match_id is not None:
+                self.newest_matches[player['id']] = (watermark.last_match_createdAt, watermark.last_match_id)
+
+            if watermark is None or watermark.last_stats_refresh is None:
+                process_players.append(player['id'])
+            elif len(played) > 0 and (watermark.last_match_createdAt is None or max(played)[0] > watermark.last_match_createdAt):
+                process_players.append(player['id'])
+
+        self.elapsed += time.perf_counter() - start
+        logging.debug("players_to_process: {0} of {1} players need their stats refreshing".format(len(process_players), len(player_ids)))
+
+        return process_players
+
+    def watermarks(self, player_ids):
+        """
+        Builds the new watermark rows for a list of players whose stats have
+        just been written, from the newest matches players_to_process saw.
+        """
+
+        now = datetime.datetime.utcnow()
+        rows = []
+
+        for player_id in player_ids:
+            created_at, match_id = self.newest_matches.get(player_id, (None, None))
+
+            rows.append(dict(
+                player_id=player_id,
+                last_match_id=match_id,
+                last_match_createdAt=created_at,
+                last_stats_refresh=now
+            ))
+
+        return rows
+
+    @profiled
+    def season_combos(self, players, seasons):
+        """
+        Returns the (player_id, season_id) combos for expired seasons that we
+        don't hold both the normal and the ranked stats for yet. Those stats
+        never change once the season is over, so the ones we have never need
+        fetching again; nor do the ones the fetch ledger says came back empty
+        or not found. A combo where either fetch failed is fetched again.
+        """
+
+        start = time.perf_counter()
+
+        player_ids = [p['id'] for p in players]
+        season_ids = [s['id'] for s in seasons if not s['attributes']['isCurrentSeason']]
+        settled = {'season': set(), 'ranked': set()}
+
+        sess = self.pubgdb.Session()
+
+        for chunk in chunks(player_ids if len(season_ids) > 0 else []):
+            for endpoint, model in (('season', PlayerSeasonStats), ('ranked', PlayerRankedSeasonStats)):
+                settled[endpoint].update(
+                    (row.player_id, row.season_id) for row in sess.query(
+                        model.player_id,
+                        model.season_id
+                    ).filter(
+                        model.player_id.in_(chunk),
+                        model.season_id.in_(season_ids)
+                    ).distinct()
+                )
+
+            for row in sess.query(
+                FetchLedger.endpoint,
+                FetchLedger.player_id,
+                FetchLedger.season_id
+            ).filter(
+                FetchLedger.endpoint.in_(settled.keys()),
+                FetchLedger.status.in_(SETTLED_STATUSES),
+                FetchLedger.player_id.in_(chunk),
+                FetchLedger.season_id.in_(season_ids)
+            ):
+                settled[row.endpoint].add((row.player_id, row.season_id))
+
+        sess.close()
+
+        existing = settled['season'] & settled['ranked']
+        combos = [(p, s) for p in player_ids for s in season_ids if (p, s) not in existing]
+
+        self.elapsed += time.perf_counter() - start
+        logging.debug("season_combos: {0} expired player-seasons to backfill".format(len(combos)))
+
+        return combos
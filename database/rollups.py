@@ -0,0 +1,187 @@
+"""
+Maintains the rollup tables the dashboards read (player_daily_stats) from
+player_match_stats joined to matches. Rather than re-aggregating the whole
+history, each chunk of matches the sync writes only recomputes the groups it
+could have changed: those of the players whose stats were written, over the
+days the matches were played. Each group is recomputed from scratch and
+upserted, so doing it twice (a resumed run, two workers sharing a match)
+comes to the same thing.
+"""
+
+import datetime
+import logging
+import time
+import metrics
+from sqlalchemy import select, func, case, and_
+from sqlalchemy.dialects.mysql import insert
+from profiling import profiled
+from .model import\
+    Match\
+    , PlayerMatchStats\
+    , PlayerDailyStats
+from .planner import chunks
+
+
+def daily_stats_select(*where):
+    """
+    The SELECT aggregating player_match_stats into player_daily_stats rows,
+    in the table's column order, over the rows matching the where clauses.
+    """
+
+    pms = PlayerMatchStats.__table__
+    match = Match.__table__
+
+    query = select([
+        pms.c.player_id,
+        func.date(match.c.createdAt),
+        match.c.gameMode,
+        match.c.mapName,
+        func.count(),
+        func.sum(case([(pms.c.winPlace == 1, 1)], else_=0)),
+        func.sum(case([(pms.c.winPlace <= 10, 1)], else_=0)),
+        func.sum(pms.c.kills),
+        func.sum(pms.c.assists),
+        func.sum(pms.c.DBNOs),
+        func.sum(pms.c.headshotKills),
+        func.sum(pms.c.revives),
+        func.sum(pms.c.damageDealt),
+        func.max(pms.c.longestKill),
+        func.sum(pms.c.timeSurvived),
+        func.sum(pms.c.walkDistance),
+        func.sum(pms.c.rideDistance)
+    ]).select_from(
+        pms.join(match, pms.c.match_id == match.c.match_id)
+    )
+
+    if len(where) > 0:
+        query = query.where(and_(*where))
+
+    return query.group_by(
+        pms.c.player_id,
+        func.date(match.c.createdAt),
+        match.c.gameMode,
+        match.c.mapName
+    )
+
+
+class DailyRollups:
+
+    def __init__(self, pubgdb):
+        """
+        pubgdb is the PUBGDatabaseConnector whose tables are rolled up.
+        """
+
+        self.pubgdb = pubgdb
+
+        return None
+
+    def upsert_statement(self, query):
+        """
+        INSERT ... SELECT of the query into player_daily_stats, replacing any
+        group that's already there.
+        """
+
+        table = PlayerDailyStats.__table__
+        columns = [c.name for c in table.columns]
+
+        if self.pubgdb.engine.dialect.name == 'sqlite':
+            return table.insert().prefix_with('OR REPLACE').from_select(columns, query)
+
+        insert_stmt = insert(table).from_select(columns, query)
+
+        return insert_stmt.on_duplicate_key_update(
+            **{c.name: insert_stmt.inserted[c.name] for c in table.columns if not c.primary_key}
+        )
+
+    @profiled
+    def update(self, match_ids):
+        """
+        Brings player_daily_stats up to date with the player_match_stats just
+        written for these matches. The groups recomputed are every tracked
+        player in the matches over every day from the first match to the last,
+        which covers those that changed and only a few more.
+        """
+
+        pms = PlayerMatchStats.__table__
+        match = Match.__table__
+
+        start = time.perf_counter()
+        conn = self.pubgdb.engine.connect()
+        player_ids = set()
+        first, last = None, None
+
+        for chunk in chunks(list(match_ids)):
+            row = conn.execute(
+                select([func.min(match.c.createdAt), func.max(match.c.createdAt)]).where(match.c.match_id.in_(chunk))
+            ).first()
+
+            if row[0] is None:
+                continue
+
+            first = row[0] if first is None else min(first, row[0])
+            last = row[1] if last is None else max(last, row[1])
+
+            player_ids.update(
+                r.player_id for r in conn.execute(
+                    select([pms.c.player_id]).where(pms.c.match_id.in_(chunk)).distinct()
+                )
+            )
+
+        if len(player_ids) == 0:
+            conn.close()
+            return True
+
+        since = datetime.datetime.combine(first.date(), datetime.time())
+        until = datetime.datetime.combine(last.date(), datetime.time()) + datetime.timedelta(days=1)
+
+        trans = conn.begin()
+        committed = False
+
+        try:
+            for chunk in chunks(sorted(player_ids)):
+                conn.execute(self.upsert_statement(daily_stats_select(
+                    pms.c.player_id.in_(chunk),
+                    match.c.createdAt >= since,
+                    match.c.createdAt < until
+                )))
+            trans.commit()
+            committed = True
+        except Exception as e:
+            logging.exception("DailyRollups.update: Error updating player_daily_stats")
+            trans.rollback()
+
+        conn.close()
+
+        metrics.observe('pubgdb_upsert_seconds', time.perf_counter() - start, table=PlayerDailyStats.__tablename__)
+
+        if not committed:
+            metrics.inc('pubgdb_upsert_failures_total', table=PlayerDailyStats.__tablename__)
+
+        logging.info("DailyRollups.update: Recomputed {0} players from {1} to {2}".format(len(player_ids), since.date(), until.date()))
+
+        return committed
+
+    @profiled
+    def rebuild(self):
+        """
+        Throws player_daily_stats away and rebuilds it from the whole of
+        player_match_stats, in one transaction, for when it's been lost or
+        is suspected of having drifted.
+        """
+
+        conn = self.pubgdb.engine.connect()
+        trans = conn.begin()
+
+        try:
+            conn.execute(PlayerDailyStats.__table__.delete())
+            conn.execute(self.upsert_statement(daily_stats_select()))
+            trans.commit()
+        except Exception as e:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+        logging.info("DailyRollups.rebuild: Rebuilt player_daily_stats")
+
+        return None
@@ -0,0 +1,173 @@
+"""
+Durable progress for sync runs. Each run records the phase it's in and, inside
+the long phases, every item it has finished with, committing as it goes; a run
+that dies can then be resumed from where it got to rather than from the start.
+"""
+
+import datetime
+import logging
+import metrics
+import profiling
+from .model import\
+    SyncRun\
+    , SyncRunItem
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+ABANDONED = 'abandoned'
+
+
+def combo_key(combo):
+    """
+    The item key for a (player_id, season_id) combo.
+    """
+
+    return '{0}/{1}'.format(combo[0], combo[1])
+
+
+class SyncRunState:
+
+    def __init__(self, pubgdb, partition_id=0):
+        """
+        pubgdb is the PUBGDatabaseConnector the run state is kept in.
+        partition_id is the partition of the players the run covers, when
+        they're split between workers; each partition's runs are separate.
+        """
+
+        self.pubgdb = pubgdb
+        self.partition_id = partition_id
+        self.run_id = None
+        self.phase = None
+
+        # phase -> {item_key: status} for everything finished so far
+        self.items = {}
+
+        return None
+
+    def start(self, resume=False):
+        """
+        Picks up the most recent unfinished run if resume is set and there is
+        one, otherwise starts a new run and marks any unfinished ones as
+        abandoned. Returns True if a run was resumed.
+        """
+
+        sess = self.pubgdb.Session()
+
+        unfinished = sess.query(SyncRun).filter_by(status=RUNNING, partition_id=self.partition_id).order_by(SyncRun.run_id.desc()).all()
+
+        if resume and len(unfinished) > 0:
+            run = unfinished[0]
+            self.run_id = run.run_id
+            self.phase = run.phase
+
+            for row in sess.query(SyncRunItem).filter_by(run_id=self.run_id):
+                self.items.setdefault(row.phase, {})[row.item_key] = row.status
+
+            sess.close()
+
+            logging.info("SyncRunState.start: resuming run {0} from phase {1} with {2} items done".format(
+                self.run_id,
+                self.phase,
+                sum(len(items) for items in self.items.values())
+            ))
+
+            return True
+
+        if resume:
+            logging.info("SyncRunState.start: no unfinished run to resume, starting a new one")
+
+        for run in unfinished:
+            sess.query(SyncRunItem).filter_by(run_id=run.run_id).delete()
+            run.status = ABANDONED
+            run.finished_at = datetime.datetime.utcnow()
+
+        run = SyncRun(partition_id=self.partition_id, started_at=datetime.datetime.utcnow(), phase='start', status=RUNNING)
+        sess.add(run)
+        sess.commit()
+
+        self.run_id = run.run_id
+        self.phase = run.phase
+
+        sess.close()
+
+        logging.info("SyncRunState.start: starting run {0}".format(self.run_id))
+
+        return False
+
+    def begin_phase(self, phase):
+        """
+        Records that the run has reached a phase.
+        """
+
+        self.phase = phase
+        metrics.set_phase(phase)
+        profiling.set_phase(phase)
+
+        sess = self.pubgdb.Session()
+        sess.query(SyncRun).filter_by(run_id=self.run_id).update({'phase': phase})
+        sess.commit()
+        sess.close()
+
+        logging.info("SyncRunState.begin_phase: run {0} entering phase {1}".format(self.run_id, phase))
+
+        return None
+
+    def done(self, phase):
+        """
+        Returns {item_key: status} for the items of a phase already finished.
+        """
+
+        return self.items.get(phase, {})
+
+    def pending(self, phase, items, key=str):
+        """
+        Filters a list of items down to those not yet finished in a phase.
+        key turns an item into its item key.
+        """
+
+        done = self.done(phase)
+
+        return [item for item in items if key(item) not in done]
+
+    def mark_done(self, phase, statuses):
+        """
+        Checkpoints a batch of finished items, given as {item_key: status}.
+        Only call this once the items' data has been committed.
+        """
+
+        if len(statuses) == 0:
+            return True
+
+        rows = [
+            dict(run_id=self.run_id, phase=phase, item_key=item_key, status=status)
+            for item_key, status in statuses.items()
+        ]
+
+        if not self.pubgdb.execute_batched(SyncRunItem, rows):
+            return False
+
+        self.items.setdefault(phase, {}).update(statuses)
+
+        return True
+
+    def finish(self):
+        """
+        Marks the run complete and clears out its item checkpoints.
+        """
+
+        sess = self.pubgdb.Session()
+        sess.query(SyncRunItem).filter_by(run_id=self.run_id).delete()
+        sess.query(SyncRun).filter_by(run_id=self.run_id).update({
+            'phase': COMPLETE,
+            'status': COMPLETE,
+            'finished_at': datetime.datetime.utcnow()
+        })
+        sess.commit()
+        sess.close()
+
+        metrics.set_phase(COMPLETE)
+        profiling.set_phase(None)
+
+        logging.info("SyncRunState.finish: run {0} complete".format(self.run_id))
+
+        return None
@@ -0,0 +1,220 @@
+"""
+Instrumentation for sync runs: API calls, rate limit waits and DB writes,
+counted and timed per endpoint or table and labelled with the phase of the
+sync they happened in. The numbers can be scraped in the Prometheus text
+format from a small HTTP server, or dumped to a file after each phase (for
+node_exporter's textfile collector, say).
+
+Everything is kept in memory in this process. With the multiprocessing pool
+engine the calls made in the worker processes aren't counted.
+"""
+
+import threading
+import time
+import os
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets (in seconds) for the latency histograms
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+# name -> (type, help)
+METRICS = {
+    'pubg_api_requests_total': ('counter', 'Calls made to the PUBG API, by endpoint and HTTP status'),
+    'pubg_api_request_seconds': ('histogram', 'Time taken by calls to the PUBG API'),
+    'pubg_api_rate_limited_total': ('counter', 'Calls the PUBG API rejected with HTTP 429'),
+    'pubg_api_rate_limit_wait_seconds_total': ('counter', 'Time spent waiting on the rate limiter before making calls'),
+    'pubg_api_cache_hits_total': ('counter', 'Calls answered from the response cache'),
+    'pubgdb_rows_upserted_total': ('counter', 'Rows committed to the DB, by table'),
+    'pubgdb_upsert_seconds': ('histogram', 'Time taken by each batched upsert'),
+    'pubgdb_upsert_failures_total': ('counter', 'Batched upserts that were rolled back'),
+    'sync_phase_seconds_total': ('counter', 'Time spent in each phase of the sync'),
+}
+
+
+class Registry:
+    """
+    The counters and histograms, keyed by metric name and label values, plus
+    the phase of the sync currently running, which every sample is labelled
+    with.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+
+        self.counters = {}
+        self.histograms = {}
+
+        self.phase = 'none'
+        self.phase_started = time.monotonic()
+
+        self.dump_path = None
+        self.server = None
+
+        return None
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted(dict(labels, phase=self.phase).items())))
+
+    def inc(self, name, value=1., **labels):
+        """
+        Add value to a counter.
+        """
+
+        with self.lock:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0.) + value
+
+        return None
+
+    def observe(self, name, value, **labels):
+        """
+        Record a value in a histogram.
+        """
+
+        with self.lock:
+            key = self._key(name, labels)
+
+            if key not in self.histograms:
+                self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0., 'count': 0}
+
+            histogram = self.histograms[key]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+        return None
+
+    def set_phase(self, phase):
+        """
+        Move on to a new phase of the sync, adding up the time spent in the
+        last one and dumping the metrics so far if there's a file to dump to.
+        """
+
+        now = time.monotonic()
+        self.inc('sync_phase_seconds_total', now - self.phase_started)
+
+        with self.lock:
+            self.phase = phase
+            self.phase_started = now
+
+        if self.dump_path is not None:
+            self.dump()
+
+        return None
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+
+        lines = []
+
+        for name, (kind, help) in METRICS.items():
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+            for (sample_name, labels), value in sorted(counters.items()):
+                if sample_name == name:
+                    lines.append('{0}{1} {2}'.format(name, format_labels(labels), format_value(value)))
+
+            for (sample_name, labels), histogram in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels + (('le', format_value(bound)),)), count))
+
+                lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels + (('le', '+Inf'),)), histogram['count']))
+                lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), format_value(histogram['sum'])))
+                lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path=None):
+        """
+        Write the metrics to a file, replacing it in one go so a scraper never
+        reads half of one.
+        """
+
+        path = path or self.dump_path
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(self.render())
+
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.exception("Registry.dump: Error writing metrics to {0}".format(path))
+
+        return None
+
+    def serve(self, port, host=''):
+        """
+        Serve the metrics over HTTP on a background thread, at any path.
+        """
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Registry.serve: " + format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        logging.info("Registry.serve: serving metrics on port {0}".format(port))
+
+        return None
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+# The registry everything reports to
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+set_phase = REGISTRY.set_phase
+
+
+def configure(port=None, path=None):
+    """
+    Start serving the metrics on a port and/or dumping them to a file.
+    """
+
+    if port is not None:
+        REGISTRY.serve(port)
+
+    REGISTRY.dump_path = path
+
+    return None
@@ -0,0 +1,252 @@
+"""
+Profiling for sync runs (sync.py --profile). Each phase of the sync is timed
+by the wall clock and by CPU, with the process's peak RSS so far, and so is
+every call to the functions marked @profiled inside it. Tracing each phase's
+own peak memory with tracemalloc is opt-in (--profile-memory): it hooks every
+allocation and slows the sync down several times over, which skews the times. Optionally a sampling profiler
+records the stacks of every thread, labelled with the phase, for flame
+graphs; it samples rather than using cProfile because most of the work is in
+the fetch engine's threads, which cProfile wouldn't see.
+
+When profiling is off, @profiled costs one attribute lookup per call.
+"""
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# Seconds between the sampling profiler's looks at the stacks
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+def peak_rss():
+    """
+    The most resident memory the process has had so far in bytes, or 0 where
+    there's no resource module. Unlike tracemalloc it costs nothing, but it
+    never goes down, so a phase only shows up in it if it set a new high.
+    """
+
+    if resource is None:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+
+        self.phase = None
+        self.phase_started = None
+
+        self.trace_memory = False
+
+        # phase -> {'wall', 'cpu', 'peak_rss', 'peak_memory', 'passes', 'functions': {name: {'calls', 'wall', 'cpu'}}}
+        self.phases = {}
+
+        # collapsed stack -> samples
+        self.stacks = {}
+        self.sample_interval = DEFAULT_SAMPLE_INTERVAL
+        self.sampler = None
+        self.stopped = threading.Event()
+
+        return None
+
+    def start(self, sample_stacks=False, sample_interval=DEFAULT_SAMPLE_INTERVAL, trace_memory=False):
+        """
+        Turn profiling on, with the sampling profiler too if sample_stacks and
+        tracemalloc if trace_memory.
+        """
+
+        self.enabled = True
+        self.trace_memory = trace_memory
+
+        if trace_memory:
+            tracemalloc.start()
+
+        if sample_stacks:
+            self.sample_interval = sample_interval
+            self.stopped.clear()
+            self.sampler = threading.Thread(target=self.sample, daemon=True)
+            self.sampler.start()
+
+        return None
+
+    def stop(self):
+        """
+        Close the phase in progress and stop profiling.
+        """
+
+        if not self.enabled:
+            return None
+
+        self.set_phase(None)
+        self.enabled = False
+
+        if self.sampler is not None:
+            self.stopped.set()
+            self.sampler.join()
+            self.sampler = None
+
+        if self.trace_memory:
+            tracemalloc.stop()
+            self.trace_memory = False
+
+        return None
+
+    def _phase_stats(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = {'wall': 0., 'cpu': 0., 'peak_rss': 0, 'peak_memory': 0, 'passes': 0, 'functions': {}}
+
+        return self.phases[phase]
+
+    def set_phase(self, phase):
+        """
+        Close the current phase, adding up its times and peak memory, and
+        start timing the next. None just closes the current one.
+        """
+
+        if not self.enabled:
+            return None
+
+        wall, cpu, rss = time.perf_counter(), time.process_time(), peak_rss()
+
+        with self.lock:
+            if self.phase is not None:
+                stats = self._phase_stats(self.phase)
+                stats['wall'] += wall - self.phase_started[0]
+                stats['cpu'] += cpu - self.phase_started[1]
+                stats['peak_rss'] = max(stats['peak_rss'], rss)
+
+                if self.trace_memory:
+                    stats['peak_memory'] = max(stats['peak_memory'], tracemalloc.get_traced_memory()[1])
+
+                stats['passes'] += 1
+
+            self.phase = phase
+            self.phase_started = (wall, cpu)
+
+        # start the next phase's peak from where memory is now
+        if self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        return None
+
+    def record(self, name, wall, cpu):
+        with self.lock:
+            stats = self._phase_stats(self.phase or 'none')['functions'].setdefault(name, {'calls': 0, 'wall': 0., 'cpu': 0.})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+
+        return None
+
+    def sample(self):
+        """
+        The sampling profiler's loop: every sample_interval, add one to the
+        collapsed stack of every other thread.
+        """
+
+        me = threading.get_ident()
+
+        while not self.stopped.wait(self.sample_interval):
+            phase = self.phase or 'none'
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+
+                stack = []
+
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+
+                key = ';'.join([phase] + stack[::-1])
+
+                with self.lock:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+        return None
+
+    def report(self):
+        """
+        The report as a dict: per phase, the wall and CPU seconds, the
+        process's peak RSS by its end in bytes, the peak memory traced during
+        it in bytes (0 unless tracing memory) and, for each profiled function,
+        its calls and inclusive wall and CPU seconds. CPU is the whole process's, so a
+        function that waits on threads is charged for their work.
+        """
+
+        with self.lock:
+            return {
+                'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'phases': json.loads(json.dumps(self.phases)),
+                'samples': sum(self.stacks.values())
+            }
+
+    def write(self, report_path, stacks_path=None):
+        """
+        Write the report as JSON, and the sampled stacks in the collapsed
+        format flamegraph.pl and speedscope read, if there are any.
+        """
+
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+        if stacks_path is not None and len(self.stacks) > 0:
+            with self.lock:
+                stacks = sorted(self.stacks.items())
+
+            with open(stacks_path, 'w') as f:
+                for stack, count in stacks:
+                    f.write('{0} {1}\n'.format(stack, count))
+
+        logging.info("Profiler.write: profile written to {0}".format(report_path))
+
+        return None
+
+
+# The profiler everything reports to
+PROFILER = Profiler()
+
+set_phase = PROFILER.set_phase
+
+
+def profiled(func):
+    """
+    Decorator timing every call to a function while profiling is on.
+    """
+
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return func(*args, **kwargs)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            PROFILER.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    return wrapper
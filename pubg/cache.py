@@ -0,0 +1,248 @@
+"""
+On-disk cache for PUBG API responses. Matches never change once they've been
+played and neither do the stats for a season that's over, so there's no need
+to spend rate-limited calls fetching them again when a sync is rerun.
+"""
+
+import sqlite3
+import zlib
+import json
+import hashlib
+import multiprocessing
+import threading
+import time
+import os
+import logging
+from urllib.parse import urlencode
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Eviction goes down to this fraction of max_bytes, so that it isn't needed
+# again on the very next put
+EVICT_TO = 0.9
+
+# Entries looked at per query while evicting
+EVICT_BATCH = 100
+
+# size comes before body: SQLite reads a row's columns in order, so reading
+# the size after a big body would mean reading the body's overflow pages too
+COLUMNS = 'key, url, status, headers, size, body, expires_at, accessed_at'
+
+# Only these headers are kept with a cached response; the body is stored
+# decompressed, and rate-limit headers would be stale by the time we read them
+KEEP_HEADERS = ('Content-Type',)
+
+
+class ResponseCache:
+    """
+    A size-bounded, zlib compressed store of API responses in a SQLite file,
+    keyed by URL and query parameters. Each entry either expires after a TTL
+    or is kept forever, and when the store grows past max_bytes the least
+    recently used entries are evicted.
+
+    Every thread (and worker process) gets its own SQLite connection, and the
+    hit and miss counters are shared between processes.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self.hits = multiprocessing.Value('l', 0)
+        self.misses = multiprocessing.Value('l', 0)
+
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            self._create(conn)
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        return None
+
+    def _create(self, conn):
+        """
+        Creates the tables, or brings a cache file from an older version up to
+        date. The total size of the entries is kept in cache_totals by
+        triggers, so that every connection, in any process, sees it without
+        adding the sizes up.
+        """
+
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(responses)')]
+
+        # older cache files have size after body; copy them over once
+        if len(columns) > 0 and columns.index('size') > columns.index('body'):
+            conn.execute('ALTER TABLE responses RENAME TO responses_old')
+
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, '
+            'headers TEXT NOT NULL, size INTEGER NOT NULL, body BLOB NOT NULL, '
+            'expires_at REAL, accessed_at REAL NOT NULL)'
+        )
+
+        if len(columns) > 0 and columns.index('size') > columns.index('body'):
+            conn.execute('INSERT INTO responses ({0}) SELECT {0} FROM responses_old'.format(COLUMNS))
+            conn.execute('DROP TABLE responses_old')
+
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_responses_expires_at ON responses (expires_at)')
+
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO cache_totals (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses")
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS tr_responses_insert AFTER INSERT ON responses BEGIN '
+            "UPDATE cache_totals SET value = value + NEW.size WHERE name = 'bytes'; END"
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS tr_responses_update AFTER UPDATE OF size ON responses BEGIN '
+            "UPDATE cache_totals SET value = value + NEW.size - OLD.size WHERE name = 'bytes'; END"
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS tr_responses_delete AFTER DELETE ON responses BEGIN '
+            "UPDATE cache_totals SET value = value - OLD.size WHERE name = 'bytes'; END"
+        )
+
+        return None
+
+    def _connect(self):
+        """
+        Returns this thread's connection, opening one if it hasn't got one yet
+        (or if it was inherited from another process).
+        """
+
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return self._local.conn
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        The cache key for a call: the URL plus its sorted query parameters.
+        """
+
+        if params:
+            url = url + '?' + urlencode(sorted(params.items()))
+
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def get(self, url, params=None):
+        """
+        Returns the cached response for a call as a requests Response, or None
+        if there isn't a live one.
+        """
+
+        key = self.key(url, params)
+        conn = self._connect()
+        now = time.time()
+
+        row = conn.execute(
+            'SELECT status, headers, body, expires_at FROM responses WHERE key = ?',
+            (key,)
+        ).fetchone()
+
+        if row is None or (row[3] is not None and row[3] < now):
+            self._count(self.misses)
+            return None
+
+        conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count(self.hits)
+
+        r = Response()
+        r.status_code = row[0]
+        r.headers = CaseInsensitiveDict(json.loads(row[1]))
+        r._content = zlib.decompress(row[2])
+        r.encoding = 'utf-8'
+        r.url = url
+
+        return r
+
+    def put(self, url, params, response, ttl=None):
+        """
+        Stores a response. ttl is in seconds; None keeps it forever.
+        """
+
+        key = self.key(url, params)
+        body = zlib.compress(response.content)
+        headers = json.dumps({h: response.headers[h] for h in KEEP_HEADERS if h in response.headers})
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+
+        conn = self._connect()
+        # an upsert rather than INSERT OR REPLACE, whose delete wouldn't fire
+        # the delete trigger
+        conn.execute(
+            'INSERT INTO responses ({0}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET url = excluded.url, status = excluded.status, '
+            'headers = excluded.headers, size = excluded.size, body = excluded.body, '
+            'expires_at = excluded.expires_at, accessed_at = excluded.accessed_at'.format(COLUMNS),
+            (key, url, response.status_code, headers, len(body), body, expires_at, now)
+        )
+
+        self.evict()
+
+        return None
+
+    def total_bytes(self):
+        """
+        The total size of the entries stored.
+        """
+
+        return self._connect().execute("SELECT value FROM cache_totals WHERE name = 'bytes'").fetchone()[0]
+
+    def evict(self):
+        """
+        Once the store has grown past max_bytes, drops the expired entries,
+        then the least recently used ones until it's down to EVICT_TO of it.
+        Under max_bytes this costs a single row lookup.
+        """
+
+        if self.total_bytes() <= self.max_bytes:
+            return None
+
+        conn = self._connect()
+        conn.execute('DELETE FROM responses WHERE expires_at < ?', (time.time(),))
+
+        total = self.total_bytes()
+        target = self.max_bytes * EVICT_TO
+        evicted = 0
+
+        while total > target:
+            rows = conn.execute('SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?', (EVICT_BATCH,)).fetchall()
+
+            if len(rows) == 0:
+                break
+
+            for key, size in rows:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                total -= size
+                evicted += 1
+
+                if total <= target:
+                    break
+
+        logging.debug("ResponseCache.evict: evicted {0} responses".format(evicted))
+
+        return None
+
+    def stats(self):
+        """
+        Returns the hit and miss counts so far.
+        """
+
+        return {'hits': self.hits.value, 'misses': self.misses.value}
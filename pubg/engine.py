@@ -0,0 +1,164 @@
+"""
+Fetch engines used by pubg_api to run lots of API calls at once. The calls
+are all I/O bound, so the default engine runs them on a pool of threads in
+this process rather than on worker processes. The original
+multiprocessing.Pool engine is kept so the two can be benchmarked against
+each other.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+DEFAULT_CONCURRENCY = 32
+
+
+class AsyncioEngine:
+    """
+    Runs the fetch function for every item on a thread pool of `concurrency`
+    threads that lives as long as the engine does, with an asyncio event loop
+    only scheduling them. requests is a blocking library, so every call in
+    flight holds an OS thread while it waits: a concurrency of a few hundred
+    means a few hundred threads, not non-blocking I/O. Running in threads
+    keeps every call inside the one pubg_api object, so its state is shared
+    rather than copied.
+    """
+
+    name = 'asyncio'
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        return None
+
+    def map(self, func, items, callback=None):
+        """
+        Call func(item) for every item and return the results in the same
+        order as items. If a callback is given, each result is passed to it
+        as soon as it's ready instead, and nothing is kept; a callback that
+        blocks holds up the event loop, which stops any more calls starting.
+        """
+
+        items = list(items)
+
+        if len(items) == 0:
+            return []
+
+        return asyncio.run(self._map(func, items, callback))
+
+    async def _map(self, func, items, callback):
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(item):
+            async with semaphore:
+                result = await loop.run_in_executor(self.executor, func, item)
+
+            if callback is not None:
+                callback(result)
+                return None
+
+            return result
+
+        return await asyncio.gather(*[run(item) for item in items])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# The object whose methods each pool worker runs, handed over once when the
+# worker starts
+_worker_target = None
+
+
+def _init_worker(target):
+    global _worker_target
+    _worker_target = target
+
+
+def _call_worker_method(call):
+    name, item = call
+
+    return getattr(_worker_target, name)(item)
+
+
+class PoolEngine:
+    """
+    The original engine: a multiprocessing.Pool of worker processes. The pool
+    is started by the first call to map and kept until the engine is closed.
+    The object func is a method of (the whole pubg_api object) goes to each
+    worker once, as it starts, which is also how the shared rate limiters get
+    to them - they can only be inherited, not pickled alongside each item.
+    So the workers see that object as it was when the pool started, and every
+    func has to be a method of it.
+    """
+
+    name = 'pool'
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.pool = None
+        self.target = None
+
+        return None
+
+    def map(self, func, items, callback=None):
+
+        items = list(items)
+
+        if len(items) == 0:
+            return []
+
+        if self.pool is None or self.target is not func.__self__:
+            self.close()
+            self.target = func.__self__
+            self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(self.target,))
+
+        calls = [(func.__name__, item) for item in items]
+
+        if callback is None:
+            return self.pool.map(_call_worker_method, calls)
+
+        try:
+            for result in self.pool.imap_unordered(_call_worker_method, calls):
+                callback(result)
+        except:
+            # the rest of the calls are already queued up in the workers, so
+            # stop them, and start a new pool next time
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            raise
+
+        return []
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+ENGINES = {
+    AsyncioEngine.name: AsyncioEngine,
+    PoolEngine.name: PoolEngine
+}
+
+
+def create_engine(name, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Build the named fetch engine.
+    """
+
+    if name not in ENGINES:
+        raise ValueError("Unknown fetch engine '{0}', choose one of: {1}".format(name, ', '.join(ENGINES)))
+
+    logging.debug("create_engine: using the {0} fetch engine".format(name))
+
+    if name == PoolEngine.name:
+        return PoolEngine()
+
+    return AsyncioEngine(concurrency)
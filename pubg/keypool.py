@@ -0,0 +1,168 @@
+"""
+A pool of PUBG API keys. Each key has its own rate limit on the API's side, so
+each gets its own RateLimiter here, and calls go to whichever key has the most
+calls left on the endpoint; with n keys the rate limited endpoints can take n
+times the calls. A key that's throttled (429) waits out its window in its own
+limiter, and one that's failing (rejected, or the API erroring on it) is
+benched for a while and the others carry on without it. The last live key is
+never benched, as there'd be nothing left to call with; a call that fails on
+it is retried after a short backoff instead.
+"""
+
+import multiprocessing
+import time
+import os
+import logging
+from .ratelimit import RateLimiter, POLL_INTERVAL, UNLIMITED_ENDPOINTS
+
+# How long to bench a key the API rejects outright (401/403): it's probably
+# been revoked, but check again now and then in case it was a blip
+AUTH_FAILURE_BENCH = 3600.
+
+# How long to bench a key after a server error, doubling with each failure in
+# a row up to MAX_FAILURE_BENCH
+FAILURE_BENCH = 5.
+MAX_FAILURE_BENCH = 300.
+
+# How long to wait before retrying a call that failed with a server error when
+# the key isn't benched, doubling with each retry of the call up to
+# MAX_RETRY_BACKOFF
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 5.
+
+
+def keys_from_environment():
+    """
+    The API keys to use: PUBG_API_KEYS if it's set, as a comma separated
+    list, otherwise the one key in PUBG_API_KEY.
+    """
+
+    keys = [key.strip() for key in os.environ.get('PUBG_API_KEYS', '').split(',') if key.strip() != '']
+
+    if len(keys) == 0:
+        keys = [os.environ.get('PUBG_API_KEY')]
+
+    return keys
+
+
+class KeyPool:
+    """
+    The keys' limiters and their bench state. Like RateLimiter, the state is
+    kept in multiprocessing Arrays so one pool can be shared by threads,
+    asyncio tasks and (by inheritance) multiprocessing workers.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.limiters = [RateLimiter() for key in keys]
+
+        # per key: when it comes off the bench, and its failures in a row
+        self._benched_until = multiprocessing.Array('d', [0.] * len(keys))
+        self._failures = multiprocessing.Array('l', [0] * len(keys))
+
+        return None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key(self, index):
+        return self.keys[index]
+
+    def live(self):
+        """
+        The indexes of the keys that aren't benched.
+        """
+
+        now = time.time()
+
+        with self._benched_until.get_lock():
+            return [i for i in range(len(self.keys)) if self._benched_until[i] <= now]
+
+    def _reserve(self, endpoint):
+        """
+        Take a token from the live key with the most left on the endpoint.
+        Returns (index, 0) if we got one, otherwise (None, seconds until it's
+        worth trying again).
+        """
+
+        live = self.live()
+
+        if len(live) == 0:
+            with self._benched_until.get_lock():
+                return None, max(min(self._benched_until[:]) - time.time(), POLL_INTERVAL)
+
+        delays = []
+
+        for i in sorted(live, key=lambda i: self.limiters[i].remaining(endpoint), reverse=True):
+            delay = self.limiters[i].try_acquire(endpoint)
+
+            if delay <= 0:
+                return i, 0.
+
+            delays.append(delay)
+
+        return None, min(delays)
+
+    def acquire(self, endpoint):
+        """
+        Block until one of the keys can make a call to the endpoint, and
+        return its index.
+        """
+
+        index, delay = self._reserve(endpoint)
+
+        while index is None:
+            logging.debug('Waiting {0:.1f}s for a key with calls left on {1}'.format(delay, endpoint))
+            time.sleep(delay)
+            index, delay = self._reserve(endpoint)
+
+        return index
+
+    def update(self, index, endpoint, headers, status_code, attempt=0):
+        """
+        Feed a response made with a key back into its limiter, and bench the
+        key if the response says it's failing. Returns None if the call
+        shouldn't be retried, otherwise how many seconds to wait before
+        retrying it: none if the key was benched and there's another to use,
+        a short backoff on a server error if not, growing with attempt (how
+        many times this call has been retried already).
+
+        A server error only benches the key on the rate limited endpoints (one
+        on /matches says nothing about the key), and no key is benched if
+        it's the last live one.
+        """
+
+        self.limiters[index].update(endpoint, headers, status_code)
+
+        if status_code not in (401, 403) and status_code < 500:
+            with self._failures.get_lock():
+                self._failures[index] = 0
+
+            return None
+
+        with self._failures.get_lock():
+            self._failures[index] += 1
+            failures = self._failures[index]
+
+        rejected = status_code in (401, 403)
+        others = [i for i in self.live() if i != index]
+
+        if len(others) > 0 and (rejected or endpoint not in UNLIMITED_ENDPOINTS):
+            if rejected:
+                bench = AUTH_FAILURE_BENCH
+            else:
+                bench = min(FAILURE_BENCH * 2 ** (failures - 1), MAX_FAILURE_BENCH)
+
+            with self._benched_until.get_lock():
+                self._benched_until[index] = time.time() + bench
+
+            logging.warning("KeyPool.update: HTTP {0} on key {1}, benching it for {2:.0f}s".format(status_code, index, bench))
+
+            return 0.
+
+        # a rejected key stays rejected, so there's no point retrying on it
+        if rejected:
+            logging.error("KeyPool.update: HTTP {0} on key {1}, the only key left".format(status_code, index))
+            return None
+
+        return min(RETRY_BACKOFF * 2 ** attempt, MAX_RETRY_BACKOFF)
@@ -3,24 +3,114 @@ Class to manage the connections to the PUBG API
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
-import time
-import os
+import queue
+import datetime
+import threading
 import multiprocessing
+import time
 import logging
+import metrics
+from profiling import profiled
+from .engine import create_engine, DEFAULT_CONCURRENCY
+from .ratelimit import endpoint_for, UNLIMITED_ENDPOINTS
+from .keypool import KeyPool, keys_from_environment
+from .cache import ResponseCache, DEFAULT_MAX_BYTES
+import re
+from collections import defaultdict
+
+# How many times to retry a call that the API rejects with HTTP 429
+MAX_RETRIES = 5
+
+# How many hosts to keep a connection pool open for
+DEFAULT_POOL_HOSTS = 4
+
+# Defaults for stream_matches: how many fetched matches can be waiting to be
+# written, and how many to hand over for writing at a time
+DEFAULT_QUEUE_DEPTH = 200
+DEFAULT_CHUNK_SIZE = 100
+
+# How often stream_matches' producer, waiting on a full queue, checks whether
+# it's been cancelled
+STREAM_POLL_INTERVAL = 0.5
+
+# The game modes the batched stats endpoints are asked about, one call each
+GAME_MODES = ['solo', 'solo-fpp', 'duo', 'duo-fpp', 'squad', 'squad-fpp']
+
+# The most players the batched stats endpoints take in one call
+BATCH_PLAYERS = 10
+
+# How long (in seconds) to cache responses that can still change, like the
+# players list or the current season's stats
+DEFAULT_CACHE_TTL = 300
+
+def batch_calls(players, game_modes):
+    """
+    The calls the batched stats endpoint takes for a season's players.
+    """
+
+    return -(-players // BATCH_PLAYERS) * game_modes
+
+def merge_game_mode_stats(records):
+    """
+    The batched stats endpoints return one record per player per game mode.
+    This merges them back into one record per player and season, with every
+    game mode's stats and match relationships in it, as the single-player
+    endpoints return.
+    """
+
+    merged = {}
+
+    for record in records:
+        key = (
+            record['relationships']['player']['data']['id'],
+            record['relationships']['season']['data']['id']
+        )
+
+        if key not in merged:
+            merged[key] = {
+                'type': record['type'],
+                'attributes': dict(record['attributes'], gameModeStats={}),
+                'relationships': {}
+            }
+
+        merged[key]['attributes']['gameModeStats'].update(record['attributes']['gameModeStats'])
+
+        for name, relationship in record['relationships'].items():
+            if name not in merged[key]['relationships']:
+                merged[key]['relationships'][name] = relationship
+            elif 'matches' in name:
+                merged[key]['relationships'][name] = {
+                    'data': merged[key]['relationships'][name]['data'] + relationship['data']
+                }
+
+    return list(merged.values())
 
-# Need a global list for multiprocessing to work properly.
-matches = []
+class StreamCancelled(Exception):
+    """
+    Raised inside stream_matches' producer when its consumer has gone away.
+    """
+
+    pass
 
 class pubg_api:
 
     def __init__(self, config):
+        # the API keys, each with its own rate limiter shared by every call
+        # made with it, whichever thread or worker process makes it.
+        # invoke_rest_api fills in the Authorization header with whichever key
+        # it picks for the call.
+        self.keys = KeyPool(keys_from_environment())
+
         self.headers = {
-            'Authorization': os.environ.get('PUBG_API_KEY'),
+            'Authorization': self.keys.key(0),
             'Accept': 'application/vnd.api+json'
         }
 
-        self.base_url = 'https://api.pubg.com/shards/'
+        # overridable so the sync can be pointed at a stand-in for the API,
+        # like the one the benchmarks use
+        self.base_url = config.get('base_url', 'https://api.pubg.com/shards/')
 
         self.shard = config['shard']
         self.player_names = config['players']
@@ -29,103 +119,363 @@ class pubg_api:
         self.player_ranked_season_stats = []
         self.player_lifetime_stats = []
         self.players = []
+        self.seasons = []
 
-        # holders for response variables, for rate-limit avoidance purposes
+        # one entry per stats fetch, see record_fetch
+        self.fetch_ledger = []
+
+        # holders for the latest response variables
         self.response_status_code = None
         self.response_headers = None
 
+        # how many calls have gone out to the rate limited endpoints (so not
+        # the matches), counted across worker processes too
+        self.requests_made = multiprocessing.Value('l', 0)
+
+        # the engine that runs batches of calls concurrently, "asyncio" unless
+        # the config asks for the old multiprocessing "pool"
+        self.engine = create_engine(
+            config.get('engine', 'asyncio'),
+            config.get('concurrency', DEFAULT_CONCURRENCY)
+        )
+
+        # one keep-alive session for every call, so we aren't paying for a new
+        # TCP+TLS handshake on each request. Each host gets its own pool of
+        # connections, big enough for every call the engine has in flight.
+        self.session = self.create_session(
+            config.get('pool_size', config.get('concurrency', DEFAULT_CONCURRENCY)),
+            config.get('pool_hosts', DEFAULT_POOL_HOSTS)
+        )
+
+        # Whether to use the batched (10 players per call, one call per game
+        # mode) stats endpoints, and which game modes to ask them for
+        self.batch_stats = config.get('batch_stats', True)
+        self.game_modes = config.get('game_modes', GAME_MODES)
+
+        # optional on-disk cache of the responses, see cache_ttl for what gets
+        # kept and for how long
+        self.cache = None
+        self.cache_ttl_seconds = config.get('cache_ttl', DEFAULT_CACHE_TTL)
+
+        if config.get('cache_path') is not None:
+            self.cache = ResponseCache(
+                config['cache_path'],
+                int(config.get('cache_max_mb', DEFAULT_MAX_BYTES // (1024 * 1024)) * 1024 * 1024)
+            )
+
         return None
 
+    def create_session(self, pool_size, pool_hosts):
+        """
+        Build the pooled requests session used by invoke_rest_api. Match and
+        stats payloads compress very well, so ask for gzip explicitly.
+        """
+
+        session = requests.Session()
+        session.headers.update({
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive'
+        })
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_size
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def close(self):
+        """
+        Release the HTTP connections and the fetch engine's workers.
+        """
+
+        self.session.close()
+        self.engine.close()
+
+        if self.cache is not None:
+            logging.info("close: Response cache hits/misses = {hits}/{misses}".format(**self.cache.stats()))
+
+        return None
+
+    def take(self, name):
+        """
+        Returns everything collected so far in one of the result lists
+        (player_season_stats, fetch_ledger and so on) and empties it, so a
+        long run can write its results away a chunk at a time.
+        """
+
+        results = getattr(self, name)
+        setattr(self, name, [])
+
+        return results
+
+    def reset(self):
+        """
+        Empties everything collected by the last sync pass, ready for the
+        next one. The seasons, the HTTP session, the keys' rate limiters and the
+        cache are kept, so a long-running process carries them from pass to
+        pass.
+        """
+
+        self.players = []
+        self.matches = []
+        self.player_season_stats = []
+        self.player_ranked_season_stats = []
+        self.player_lifetime_stats = []
+        self.fetch_ledger = []
+
+        return None
+
+    def cache_ttl(self, url):
+        """
+        How long to cache the response for a URL, in seconds; None means
+        forever. A match never changes once it's been played and nor do the
+        stats for a season that's over, so those are kept for good; anything
+        else (the players list, lifetime stats, the current season) only
+        briefly, so that a rerun straight after a crash can use it.
+        """
+
+        endpoint = endpoint_for(url)
+
+        if endpoint == 'matches':
+            return None
+
+        if endpoint in ('stats', 'ranked'):
+            season = re.search(r'/seasons/([^/?]+)', url)
+            past_seasons = [s['id'] for s in self.seasons if not s['attributes']['isCurrentSeason']]
+
+            if season is not None and season.group(1) in past_seasons:
+                return None
+
+        return self.cache_ttl_seconds
+
     def invoke_rest_api(self, url, headers, params=None):
         """
         All the calls to the API are done through this function, so that any necessary changes can easily
         be made in one place
         """
 
-        # rate limiting goes here. Check the latest response header dict and
-        # see if it has the rate limit headers. If it does and we're out of 
-        # calls, wait till the reset. Otherwise, just run the func.
-
-        # if we've actually run something already
-        if self.response_status_code is not None:
-            # and it has a rate limit
-            if 'X-Ratelimit-Remaining' in self.response_headers.keys():
-                # if the rate limit is 0
-                if self.response_headers['X-Ratelimit-Remaining'] == '0':
-                    # rather than a bare sleep we'll while away the time till current > reset time, so that in the case
-                    # we end up waiting past the reset time of the last call due to db writes or whatever we're not unecessarily 
-                    # hanging around.
-                    reset_time = float(self.response_headers['X-Ratelimit-Reset'])
-
-                    # log here since this is the first place we're _actually_ waiting
-                    logging.debug('Waiting {0}s to avoid rate limiter'.format((reset_time-time.time()) + 5.))
-
-                    while time.time() < (reset_time + 5):
-                        continue
-
-        # our waiting is done, on with the call, yo!
-        r = requests.get(
-            url=url,
-            headers=headers,
-            params=params
-        )
+        # Serve the call from the cache if we can, which costs no rate limit
+        if self.cache is not None:
+            r = self.cache.get(url, params)
+
+            if r is not None:
+                metrics.inc('pubg_api_cache_hits_total', endpoint=endpoint_for(url))
+                return r
+
+        # rate limiting goes here. Each key has its own limiter, with a bucket
+        # per class of endpoint fed from the headers of the responses; the key
+        # pool picks the key with the most calls left on the endpoint, and
+        # sleeps if none has a call to spare. If we get a 429 anyway (a
+        # limiter only learns the limit from its key's first response) that
+        # bucket is emptied and we go round again, as we do if the key is
+        # failing and gets benched while there are others to use.
+        endpoint = endpoint_for(url)
+
+        for attempt in range(MAX_RETRIES + 1):
+            start = time.perf_counter()
+            index = self.keys.acquire(endpoint)
+            sent = time.perf_counter()
+
+            r = self.session.get(
+                url=url,
+                headers=dict(headers, Authorization=self.keys.key(index)),
+                params=params
+            )
+
+            metrics.inc('pubg_api_rate_limit_wait_seconds_total', sent - start, endpoint=endpoint)
+            metrics.observe('pubg_api_request_seconds', time.perf_counter() - sent, endpoint=endpoint)
+            metrics.inc('pubg_api_requests_total', endpoint=endpoint, status=r.status_code)
+
+            if r.status_code == 429:
+                metrics.inc('pubg_api_rate_limited_total', endpoint=endpoint)
+
+            # store the latest response code and headers
+            self.response_status_code = r.status_code
+            self.response_headers = r.headers
 
-        # store the latest response code and headers
-        self.response_status_code = r.status_code
-        self.response_headers = r.headers
+            retry_after = self.keys.update(index, endpoint, r.headers, r.status_code, attempt)
+
+            if endpoint not in UNLIMITED_ENDPOINTS:
+                with self.requests_made.get_lock():
+                    self.requests_made.value += 1
+
+            if r.status_code != 429 and retry_after is None:
+                break
+
+            if attempt == MAX_RETRIES:
+                break
+
+            logging.debug("invoke_rest_api: HTTP {0} from {1} on key {2}, retrying".format(r.status_code, url, index))
+
+            if retry_after:
+                time.sleep(retry_after)
+
+        if self.cache is not None and r.status_code == 200:
+            self.cache.put(url, params, r, self.cache_ttl(url))
 
         return r
 
+    @profiled
     def get_players(self):
 
-        module = '/players'
+        pages = [self.player_names[i:i+10] for i in range(0, len(self.player_names), 10)]
 
-        i = 0
+        for page in self.engine.map(self.get_players_page, pages):
+            self.players = self.players + page
 
-        while i < len(self.player_names):
+        return True
 
-            payload = {'filter[playerNames]': ','.join(self.player_names[i:i+10])
-            }
+    def get_players_page(self, player_names):
+        """
+        Fetch a single page of (up to 10) players by name.
+        """
 
-            logging.debug("get_players:Payload = [{0}]".format(','.join(self.player_names[i:i+10])))
+        module = '/players'
 
-            try:
-                r = self.invoke_rest_api(
-                    url=self.base_url + self.shard + module,
-                    headers=self.headers,
-                    params=payload
-                    )
-            except Exception as e:
-                logging.exception("get_players: API Request")
+        payload = {'filter[playerNames]': ','.join(player_names)
+        }
 
-            try:
-                self.players = self.players + r.json()['data']
-            except Exception as e:
-                logging.exception("get_players: Append to players")
+        logging.debug("get_players:Payload = [{0}]".format(','.join(player_names)))
 
-            i += 10
+        try:
+            r = self.invoke_rest_api(
+                url=self.base_url + self.shard + module,
+                headers=self.headers,
+                params=payload
+                )
+        except Exception as e:
+            logging.exception("get_players: API Request")
 
-        return True
+        try:
+            return r.json()['data']
+        except Exception as e:
+            logging.exception("get_players: Append to players")
+
+        return []
 
 
+    @profiled
     def get_matches(self, process_matches):
 
-        with multiprocessing.Pool() as pool:
-            multiprocessed_matches = pool.map(self.get_match, process_matches)
+        fetched_matches = self.engine.map(self.get_match, process_matches)
 
-        self.matches = [i for j in multiprocessed_matches for i in j]
+        self.matches = self.collect_matches(fetched_matches)
         logging.info("get_matches: Num Matches fetched = {0}".format(len(self.matches)))
 
         return True
 
-    def get_match(self, match_id):
+    def stream_matches(self, process_matches, chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=DEFAULT_QUEUE_DEPTH):
         """
-        Fetch a single match by calling the PUBG API, and append it to the list
-        of matches
+        Generator version of get_matches. The matches are fetched on a
+        background thread and yielded in lists of up to chunk_size as they
+        arrive, so they can be written to the DB while later ones are still
+        downloading. At most queue_depth fetched matches wait to be picked up;
+        once the queue is full the fetching pauses, which caps the memory
+        used however many matches there are. Nothing is kept in self.matches.
+        """
+
+        fetched = queue.Queue(maxsize=queue_depth)
+        done = object()
+
+        # set when the consumer goes away (it's finished, or the code writing
+        # the matches raised), to tell the producer to give up
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    fetched.put(item, timeout=STREAM_POLL_INTERVAL)
+                    return None
+                except queue.Full:
+                    pass
+
+            # unwinds the fetch engine, which stops it starting more calls
+            raise StreamCancelled()
+
+        def produce():
+            try:
+                self.engine.map(self.get_match, process_matches, callback=put)
+            except StreamCancelled:
+                logging.info("stream_matches: Fetching cancelled")
+            except Exception as e:
+                logging.exception("stream_matches: Error fetching matches")
+            finally:
+                try:
+                    put(done)
+                except StreamCancelled:
+                    pass
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        chunk = []
+        num_matches = 0
+
+        try:
+            while True:
+                item = fetched.get()
+
+                if item is done:
+                    break
+
+                matches = self.collect_matches([item])
+                chunk += matches
+                num_matches += len(matches)
+
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+
+            if len(chunk) > 0:
+                yield chunk
+        finally:
+            # runs however the generator ends, including the caller raising
+            # or closing it (GeneratorExit), so the producer never blocks on
+            # a queue nobody reads
+            stop.set()
+
+            while True:
+                try:
+                    fetched.get_nowait()
+                except queue.Empty:
+                    break
+
+            producer.join()
+
+        logging.info("stream_matches: Num Matches fetched = {0}".format(num_matches))
+
+        return None
+
+    def collect_matches(self, fetched_matches):
+        """
+        Turns what get_match returned for a batch of matches into the list of
+        match bodies, recording the matches that didn't come back in the
+        fetch ledger (against the 'match' endpoint, with the match ID in place
+        of the player ID) so the sync can tell the ones that will never come
+        back (404) from the ones worth trying again.
         """
 
         matches = []
 
+        for match_id, status, match in fetched_matches:
+            if match is not None and 'data' in match:
+                matches.append(match)
+            else:
+                self.record_fetch('match', (match_id, ''), status if status != 'ok' else 'error')
+
+        return matches
+
+    def get_match(self, match_id):
+        """
+        Fetch a single match by calling the PUBG API. Returns the match ID, the
+        status ('ok' or the HTTP status code, 'error' if the call itself
+        failed) and the match, which is None unless the call returned HTTP
+        200.
+        """
+
         logging.debug("get_match: match_id={0}".format(match_id))
 
         module = '/matches/{0}'.format(match_id)
@@ -137,14 +487,20 @@ class pubg_api:
             )
         except Exception as e:
             logging.exception("get_match: API Request:")
+            return (match_id, 'error', None)
+
+        if r.status_code != 200:
+            logging.warning("get_match: {0} returned HTTP {1}".format(match_id, r.status_code))
+            return (match_id, str(r.status_code), None)
 
         try:
-            matches.append(r.json())
+            return (match_id, 'ok', r.json())
         except:
-            logging.exception("get_match: Append to matches")
+            logging.exception("get_match: Error reading match {0}".format(match_id))
 
-        return matches
+        return (match_id, 'error', None)
 
+    @profiled
     def get_seasons(self):
         """
         Fetch the list of seasons from the API. This shouldn't change more than
@@ -173,12 +529,214 @@ class pubg_api:
 
         return [season for season in self.seasons if season['attributes']['isCurrentSeason']]
 
+    @profiled
+    def get_season_stats(self, combos):
+        """
+        Fetch both the normal and the ranked season stats for every
+        (player_id, season_id) combo, running the calls through the fetch
+        engine. Unless batch_stats is off the normal stats come from the
+        batched endpoint for the seasons where that takes fewer calls (see
+        split_batched); there's no batched version of the ranked one.
+        """
+
+        batched, single = self.split_batched(combos)
+
+        if len(batched) > 0:
+            self.player_season_stats += self.fetch_stats_batched(batched, 'season')
+
+        for combo, (status, data) in zip(single, self.engine.map(self.fetch_player_season_stats, single)):
+            self.record_fetch('season', combo, status)
+
+            if data is not None:
+                self.player_season_stats.append(data)
+
+        for combo, (status, data) in zip(combos, self.engine.map(self.fetch_player_ranked_season_stats, combos)):
+            self.record_fetch('ranked', combo, status)
+
+            if data is not None:
+                self.player_ranked_season_stats.append(data)
+
+        return None
+
+    def record_fetch(self, endpoint, combo, status):
+        """
+        Add an entry to the fetch ledger for a (player_id, season_id) combo.
+        status is 'ok' if we got stats, 'empty' if the call worked but there
+        weren't any, otherwise the HTTP status code.
+        """
+
+        self.fetch_ledger.append({
+            'endpoint': endpoint,
+            'player_id': combo[0],
+            'season_id': combo[1],
+            'status': status,
+            'fetched_at': datetime.datetime.utcnow()
+        })
+
+        return None
+
+    def estimate_calls(self, combos, endpoint):
+        """
+        An upper bound on the calls it takes to fetch the stats for a list of
+        (player_id, season_id) combos: endpoint is 'season' for the normal and
+        ranked season stats, or 'lifetime' (with 'lifetime' as the season).
+        Cached responses make the real number lower.
+        """
+
+        batched, single = self.split_batched(combos)
+
+        players_by_season = defaultdict(set)
+
+        for combo in batched:
+            players_by_season[combo[1]].add(combo[0])
+
+        calls = len(single) + sum(
+            batch_calls(len(player_ids), len(self.game_modes))
+            for player_ids in players_by_season.values()
+        )
+
+        # there's no batched ranked endpoint
+        if endpoint == 'season':
+            calls += len(combos)
+
+        return calls
+
+    def split_batched(self, combos):
+        """
+        Splits a list of (player_id, season_id) combos, where the season can
+        be 'lifetime', into those to fetch through the batched endpoint and
+        those to fetch one player at a time, season by season, batching a
+        season only if that takes fewer calls. Each batched call covers 10
+        players but only one game mode, so with all six modes a season with a
+        handful of players to fetch is cheaper a player at a time. With
+        batch_stats off nothing is batched.
+        """
+
+        if not self.batch_stats:
+            return [], list(combos)
+
+        players_by_season = defaultdict(set)
+
+        for combo in combos:
+            players_by_season[combo[1]].add(combo[0])
+
+        batched_seasons = {
+            season_id for season_id, player_ids in players_by_season.items()
+            if batch_calls(len(player_ids), len(self.game_modes)) < len(player_ids)
+        }
+
+        batched = [combo for combo in combos if combo[1] in batched_seasons]
+        single = [combo for combo in combos if combo[1] not in batched_seasons]
+
+        return batched, single
+
+    @profiled
+    def fetch_stats_batched(self, combos, endpoint):
+        """
+        Fetch the stats for a list of (player_id, season_id) combos through
+        /seasons/{season}/gameMode/{mode}/players, which takes up to 10
+        players at a time but only one game mode. The season can also be
+        'lifetime', for /seasons/lifetime/gameMode/{mode}/players. Returns
+        one record per combo, in the same shape as the single-player endpoint
+        returns, so the upserts don't know the difference. Each combo is
+        recorded in the fetch ledger against endpoint.
+        """
+
+        players_by_season = defaultdict(list)
+
+        for combo in combos:
+            if combo[0] not in players_by_season[combo[1]]:
+                players_by_season[combo[1]].append(combo[0])
+
+        batches = [
+            (season_id, game_mode, player_ids[i:i + BATCH_PLAYERS])
+            for season_id, player_ids in players_by_season.items()
+            for game_mode in self.game_modes
+            for i in range(0, len(player_ids), BATCH_PLAYERS)
+        ]
+
+        logging.debug("fetch_stats_batched: {0} combos in {1} calls".format(len(combos), len(batches)))
+
+        records = []
+        statuses = defaultdict(set)
+
+        for batch, (status, data) in zip(batches, self.engine.map(self.fetch_stats_batch, batches)):
+            records += data
+
+            for player_id in batch[2]:
+                statuses[(player_id, batch[0])].add(status)
+
+        merged = merge_game_mode_stats(records)
+        found = {(m['relationships']['player']['data']['id'], m['relationships']['season']['data']['id']) for m in merged}
+
+        for combo, combo_statuses in statuses.items():
+            # a failure on any of the game modes means we haven't got the
+            # whole picture for the combo, so the ledger records the failure
+            failures = combo_statuses - {'ok', 'empty'}
+
+            if len(failures) > 0:
+                self.record_fetch(endpoint, combo, sorted(failures)[0])
+            elif combo in found:
+                self.record_fetch(endpoint, combo, 'ok')
+            else:
+                self.record_fetch(endpoint, combo, 'empty')
+
+        return merged
+
+    def fetch_stats_batch(self, batch):
+        """
+        Makes a single call to the batched stats endpoint. batch is a tuple of
+        (season_id, game_mode, [player_id, ...]). Returns the status of the
+        call and the list of records.
+        """
+
+        season_id, game_mode, player_ids = batch
+
+        module = '/seasons/{0}/gameMode/{1}/players'.format(
+            season_id,
+            game_mode
+        )
+
+        payload = {'filter[playerIds]': ','.join(player_ids)}
+
+        r = self.invoke_rest_api(
+            url=self.base_url + self.shard + module,
+            headers=self.headers,
+            params=payload
+        )
+
+        if r.status_code == 200:
+            try:
+                data = r.json()['data']
+                return ('ok' if len(data) > 0 else 'empty', data)
+            except:
+                logging.exception("fetch_stats_batch: Error reading data from the response")
+        else:
+            logging.debug("fetch_stats_batch: {0}: {1} returned HTTP {2}".format(season_id, game_mode, r.status_code))
+
+        return (str(r.status_code), [])
+
     def get_player_ranked_season_stats(self, combo):
         """
         Fetches the ranked player season stats. Combo is a tuple consisting of
         (player_id, season_id).
         """
 
+        status, data = self.fetch_player_ranked_season_stats(combo)
+        self.record_fetch('ranked', combo, status)
+
+        if data is not None:
+            self.player_ranked_season_stats.append(data)
+
+        return None
+
+    def fetch_player_ranked_season_stats(self, combo):
+        """
+        Does the actual work for get_player_ranked_season_stats, returning the
+        status and data rather than storing them so that it can run in any
+        fetch engine.
+        """
+
         module = '/players/{0}/seasons/{1}/ranked'.format(
             combo[0],
             combo[1]
@@ -189,30 +747,46 @@ class pubg_api:
             headers=self.headers
         )
 
-        logging.debug("get_player_ranked_season_stats: {0}: {1}: {2}".format(combo[0], combo[1], json.dumps(r.json(), indent=4)))
-
         if r.status_code == 200:
+            logging.debug("get_player_ranked_season_stats: {0}: {1}: {2}".format(combo[0], combo[1], json.dumps(r.json(), indent=4)))
+
             try:
-                self.player_ranked_season_stats.append(
-                    r.json()['data']
-                )
+                data = r.json()['data']
+
+                if len(data['attributes']['rankedGameModeStats']) == 0:
+                    return ('empty', None)
+
+                return ('ok', data)
             except:
                 logging.exception("get_player_ranked_season_stats: Error appending data to list")
         else:
             logging.debug("get_player_ranked_season_stats returned something other than HTTP 200")
 
-        return None
+        return (str(r.status_code), None)
 
     def get_player_season_stats(self, combo):
         """
-        This call has to be rate limited, as it's pretty fast to complete which
-        means it often hits the API's transaction limit and returns a html 429
-        code. 4 second pauses between calls seems to avoid the issue, but I'll
-        include a condition to pause for 20 seconds if it hits the issue.
+        This call is rate limited by the API, so it's pretty likely to have
+        to wait on the limiter in invoke_rest_api.
 
         combo is a (player_id, season_id) tuple
         """
 
+        status, data = self.fetch_player_season_stats(combo)
+        self.record_fetch('season', combo, status)
+
+        if data is not None:
+            self.player_season_stats.append(data)
+
+        return None
+
+    def fetch_player_season_stats(self, combo):
+        """
+        Does the actual work for get_player_season_stats, returning the status
+        and data rather than storing them so that it can run in any fetch
+        engine.
+        """
+
         module ='/players/{0}/seasons/{1}'.format(
             combo[0],
             combo[1]
@@ -223,57 +797,62 @@ class pubg_api:
             headers=self.headers
         )
 
-        while r.status_code == 429:
-            time.sleep(10)
-
-            r = self.invoke_rest_api(
-                url=self.base_url + self.shard + module,
-                headers=self.headers
-            )
-
-        logging.debug("get_player_season_stats: {0}: {1}: {2}".format(combo[0], combo[1], json.dumps(r.json(), indent=4)))
-
         if r.status_code == 200:
+            logging.debug("get_player_season_stats: {0}: {1}: {2}".format(combo[0], combo[1], json.dumps(r.json(), indent=4)))
+
             try:
-                self.player_season_stats.append(
-                    r.json()['data']
-                )
+                return ('ok', r.json()['data'])
             except:
                 logging.exception("get_player_season_stats: Error appending data to list")
         else:
             logging.debug("get_player_season_stats returned something other than HTTP 200")
 
-        return None
+        return (str(r.status_code), None)
 
+    @profiled
     def get_player_lifetime_stats(self, process_players):
+        """
+        Fetch the lifetime stats for a list of player IDs. Unless batch_stats
+        is off this goes through the batched endpoint, 10 players per call
+        per game mode, if that takes fewer calls than a player at a time.
+        """
 
-        for player in process_players:
-            module = '/players/{0}/seasons/lifetime'.format(
-                player
-            )
-
-            r = self.invoke_rest_api(
-                url=self.base_url + self.shard + module,
-                headers=self.headers
-            )
+        batched, single = self.split_batched([(player, 'lifetime') for player in process_players])
 
-            while r.status_code == 429:
-                time.sleep(10)
+        if len(batched) > 0:
+            self.player_lifetime_stats += self.fetch_stats_batched(batched, 'lifetime')
 
-                r = self.invoke_rest_api(
-                    url=self.base_url + self.shard + module,
-                    headers=self.headers
-                )
+        players = [combo[0] for combo in single]
 
-            if r.status_code == 200:
-                try:
-                    self.player_lifetime_stats.append(
-                        r.json()['data']
-                    )
-                except:
-                    logging.exception("get_player_lifetime_stats: Error appending data to list")
-            else:
-                logging.debug("get_player_lifetime_stats returned something other than HTTP 200")
+        for player, (status, data) in zip(players, self.engine.map(self.fetch_player_lifetime_stats, players)):
+            self.record_fetch('lifetime', (player, 'lifetime'), status)
 
+            if data is not None:
+                self.player_lifetime_stats.append(data)
 
         return None
+
+    def fetch_player_lifetime_stats(self, player):
+        """
+        Fetch the lifetime stats of a single player, returning the status and
+        data.
+        """
+
+        module = '/players/{0}/seasons/lifetime'.format(
+            player
+        )
+
+        r = self.invoke_rest_api(
+            url=self.base_url + self.shard + module,
+            headers=self.headers
+        )
+
+        if r.status_code == 200:
+            try:
+                return ('ok', r.json()['data'])
+            except:
+                logging.exception("get_player_lifetime_stats: Error appending data to list")
+        else:
+            logging.debug("get_player_lifetime_stats returned something other than HTTP 200")
+
+        return (str(r.status_code), None)
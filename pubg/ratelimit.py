@@ -0,0 +1,169 @@
+"""
+Token-bucket rate limiter for the PUBG API, with one bucket per class of
+endpoint so that a throttled stats endpoint never holds up the (unlimited)
+match downloads.
+"""
+
+import multiprocessing
+import time
+import re
+
+ENDPOINTS = ('players', 'seasons', 'stats', 'ranked', 'lifetime', 'matches')
+
+# The endpoints the API doesn't rate limit
+UNLIMITED_ENDPOINTS = ('matches',)
+
+# The API's reset time is to the second and our clock won't exactly match
+# theirs, so hang on a little past it before trusting the bucket is full.
+RESET_MARGIN = 5.
+
+# How long to back off after a 429 that didn't tell us when to come back.
+DEFAULT_BACKOFF = 10.
+
+# How often to look again at an empty bucket whose reset time isn't known yet.
+POLL_INTERVAL = 1.
+
+# slot offsets for each bucket in the shared state array
+_LIMIT = 0
+_REMAINING = 1
+_RESET = 2
+_SLOTS = 3
+
+
+def endpoint_for(url):
+    """
+    Work out which class of endpoint a URL belongs to.
+    """
+
+    if '/matches/' in url:
+        return 'matches'
+    elif re.search(r'/ranked/?$', url):
+        return 'ranked'
+    elif '/seasons/lifetime' in url:
+        return 'lifetime'
+    elif re.search(r'/seasons/?$', url):
+        return 'seasons'
+    elif '/seasons/' in url:
+        return 'stats'
+
+    return 'players'
+
+
+class RateLimiter:
+    """
+    Tracks one token bucket per endpoint class. The buckets are fed by the
+    X-Ratelimit-* headers on each response; a bucket with no headers yet (or
+    one the API doesn't limit, like /matches) never blocks.
+
+    The state lives in a multiprocessing.Array and is only touched under that
+    array's lock, so a single limiter can be shared by threads, asyncio tasks
+    and (by inheritance) multiprocessing workers.
+    """
+
+    def __init__(self):
+        self._state = multiprocessing.Array('d', [-1.] * (len(ENDPOINTS) * _SLOTS))
+
+        return None
+
+    def _offset(self, endpoint):
+        return ENDPOINTS.index(endpoint) * _SLOTS
+
+    def _reserve(self, endpoint):
+        """
+        Take a token from the endpoint's bucket if there is one. Returns 0 if
+        we got a token, otherwise the number of seconds until the bucket
+        should refill.
+        """
+
+        i = self._offset(endpoint)
+
+        with self._state.get_lock():
+            limit = self._state[i + _LIMIT]
+            remaining = self._state[i + _REMAINING]
+            reset_time = self._state[i + _RESET]
+
+            # no rate limit headers seen for this endpoint yet
+            if remaining < 0:
+                return 0.
+
+            now = time.time()
+
+            # the window has reset, so refill the bucket. We don't know when
+            # the new window ends until a response tells us.
+            if reset_time > 0 and now >= reset_time + RESET_MARGIN:
+                remaining = max(limit, 1.)
+                reset_time = 0.
+                self._state[i + _RESET] = reset_time
+
+            if remaining >= 1:
+                self._state[i + _REMAINING] = remaining - 1
+                return 0.
+
+            if reset_time <= 0:
+                return POLL_INTERVAL
+
+            return (reset_time + RESET_MARGIN) - now
+
+    def try_acquire(self, endpoint):
+        """
+        Take a call on the endpoint without waiting. Returns 0 if it's
+        allowed, otherwise how many seconds to wait before trying again.
+        """
+
+        return self._reserve(endpoint)
+
+    def remaining(self, endpoint):
+        """
+        How many calls the endpoint's bucket has left, as far as we know;
+        infinite if we haven't seen its limit yet.
+        """
+
+        i = self._offset(endpoint)
+
+        with self._state.get_lock():
+            if self._state[i + _REMAINING] < 0:
+                return float('inf')
+
+            reset_time = self._state[i + _RESET]
+
+            if reset_time > 0 and time.time() >= reset_time + RESET_MARGIN:
+                return max(self._state[i + _LIMIT], 1.)
+
+            return self._state[i + _REMAINING]
+
+    def update(self, endpoint, headers, status_code=None):
+        """
+        Feed the bucket for an endpoint from a response's headers. Responses
+        can come back out of order when lots of calls are in flight, so a
+        stale header (from an older reset window) is ignored and within one
+        window we keep the lower of our count and the API's.
+        """
+
+        i = self._offset(endpoint)
+
+        with self._state.get_lock():
+            if 'X-Ratelimit-Remaining' in headers:
+                limit = float(headers.get('X-Ratelimit-Limit', 0))
+                remaining = float(headers['X-Ratelimit-Remaining'])
+                reset_time = float(headers.get('X-Ratelimit-Reset', time.time() + DEFAULT_BACKOFF))
+
+                if reset_time < time.time():
+                    # left over from a window that's already over
+                    pass
+                elif reset_time > self._state[i + _RESET]:
+                    self._state[i + _REMAINING] = remaining
+                    self._state[i + _RESET] = reset_time
+                elif reset_time == self._state[i + _RESET]:
+                    self._state[i + _REMAINING] = min(remaining, self._state[i + _REMAINING])
+
+                self._state[i + _LIMIT] = max(limit, self._state[i + _LIMIT])
+
+            if status_code == 429:
+                # whatever the headers said, the bucket is empty right now
+                self._state[i + _REMAINING] = 0
+                self._state[i + _RESET] = max(
+                    self._state[i + _RESET],
+                    float(headers.get('X-Ratelimit-Reset', time.time() + DEFAULT_BACKOFF))
+                )
+
+        return None
@@ -0,0 +1,118 @@
+"""
+Decides how much of a run's stats work to do, given a budget of rate limited
+API calls and a deadline. Work is offered to it in priority order (the
+current season, then lifetime stats, then backfilling expired seasons) and it
+hands back only what fits; the rest is deferred, and the planner picks it up
+again next run since nothing for it gets written.
+"""
+
+import time
+import logging
+
+# The order the sync hands work to the scheduler in, most important first
+PRIORITIES = ('current_season', 'lifetime', 'backfill')
+
+
+class BudgetScheduler:
+
+    def __init__(self, api, budget=None, deadline=None):
+        """
+        api is the pubg_api whose calls are counted. budget is the most calls
+        to the rate limited endpoints the run may make, counted from now, and
+        deadline how many seconds from now to stop starting new work; None
+        means no limit for either.
+        """
+
+        self.api = api
+        self.budget = budget
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.start_requests = api.requests_made.value
+        self.deferred = {priority: 0 for priority in PRIORITIES}
+
+        return None
+
+    def used(self):
+        """
+        The calls made since the scheduler was set up.
+        """
+
+        return self.api.requests_made.value - self.start_requests
+
+    def remaining(self):
+        """
+        The calls left in the budget, None if there's no budget.
+        """
+
+        if self.budget is None:
+            return None
+
+        return max(self.budget - self.used(), 0)
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def fit(self, priority, items, cost):
+        """
+        Returns the longest leading slice of items whose estimated cost (from
+        cost(items)) fits in what's left of the budget, or nothing once the
+        deadline has passed. Whatever doesn't fit is counted as deferred.
+        """
+
+        if self.expired():
+            take = 0
+        elif self.budget is None:
+            take = len(items)
+        else:
+            remaining = self.remaining()
+
+            # cost only goes up with more items, so binary search for the
+            # longest slice that fits
+            low, high = 0, len(items)
+
+            while low < high:
+                mid = (low + high + 1) // 2
+
+                if cost(items[:mid]) <= remaining:
+                    low = mid
+                else:
+                    high = mid - 1
+
+            take = low
+
+        self.deferred[priority] += len(items) - take
+
+        return items[:take]
+
+    def schedule(self, priority, items, chunk_size, cost):
+        """
+        Generator handing out the items a chunk at a time, for as long as the
+        budget and deadline allow. Each chunk is checked just before it's
+        handed out, so the calls made for the previous one are counted.
+        """
+
+        for i in range(0, len(items), chunk_size):
+            offered = items[i:i + chunk_size]
+            chunk = self.fit(priority, offered, cost)
+
+            if len(chunk) > 0:
+                yield chunk
+
+            if len(chunk) < len(offered):
+                # out of budget or time, so the rest is deferred too
+                self.deferred[priority] += len(items) - i - len(offered)
+                break
+
+        return None
+
+    def report(self):
+        """
+        Logs how many calls were made and what was left for next run.
+        """
+
+        logging.info("BudgetScheduler.report: {0} calls made{1}, deferred to next run: {2}".format(
+            self.used(),
+            '' if self.budget is None else ' of a budget of {0}'.format(self.budget),
+            ', '.join('{0} {1}'.format(count, priority) for priority, count in self.deferred.items())
+        ))
+
+        return None
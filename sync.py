@@ -1,15 +1,31 @@
-from sqlalchemy import create_engine
-from database.model import *
-from database.api import PUBGDatabaseConnector
-from pubg.pubg_api import pubg_api
+from database.api import PUBGDatabaseConnector, DEFAULT_BATCH_SIZE
+from database.planner import SyncPlanner, chunks, SETTLED_STATUSES
+from database.runstate import SyncRunState, combo_key
+from database.leases import PartitionLeases, MatchClaims, partition_for
+from database.rollups import DailyRollups
+from pubg.pubg_api import pubg_api, DEFAULT_QUEUE_DEPTH, DEFAULT_CHUNK_SIZE
+from pubg.scheduler import BudgetScheduler
 import json
 import datetime
 import pymysql
 import os
 import click
 import logging
+import metrics
+import profiling
+import signal
+import socket
+from contextlib import closing
+import threading
+import time
 
-@click.command()
+# The API docs ask that /seasons isn't called more than about once a month
+SEASONS_MAX_AGE = datetime.timedelta(days=30)
+
+# Minutes between the starts of the passes in daemon mode
+DEFAULT_INTERVAL = 30.
+
+@click.group(invoke_without_command=True)
 @click.option(
     '--log-level',
     'loglevel',
@@ -22,12 +38,245 @@ import logging
     is_flag=True,
     help='Echo SQL Alchemy output to stdout'
 )
-def sync(loglevel, echo):
+@click.option(
+    '--engine',
+    'engine',
+    type=click.Choice(['asyncio', 'pool']),
+    default=None,
+    help='Fetch engine for concurrent API calls (overrides config.json, default asyncio)'
+)
+@click.option(
+    '--concurrency',
+    'concurrency',
+    type=int,
+    default=None,
+    help='Maximum number of API calls in flight with the asyncio engine'
+)
+@click.option(
+    '--batch-size',
+    'batch_size',
+    type=int,
+    default=DEFAULT_BATCH_SIZE,
+    help='Number of rows written to MySQL per upsert statement'
+)
+@click.option(
+    '--stream',
+    'stream',
+    is_flag=True,
+    help='Write matches to the DB in chunks while the rest are still downloading'
+)
+@click.option(
+    '--queue-depth',
+    'queue_depth',
+    type=int,
+    default=DEFAULT_QUEUE_DEPTH,
+    help='With --stream, the most fetched matches that can wait to be written'
+)
+@click.option(
+    '--chunk-size',
+    'chunk_size',
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help='Number of matches, or of stats fetches, written to the DB (and checkpointed) at a time'
+)
+@click.option(
+    '--cache/--no-cache',
+    'cache',
+    default=True,
+    help='Cache API responses on disk (in api_cache.sqlite next to config.json unless config.json says otherwise)'
+)
+@click.option(
+    '--resume',
+    'resume',
+    is_flag=True,
+    help='Carry on from the last checkpoint of a sync run that didn\'t finish'
+)
+@click.option(
+    '--partitions',
+    'partitions',
+    type=int,
+    default=None,
+    help='Number of hash partitions the players are split into between sync workers sharing the DB (overrides config.json, default 1)'
+)
+@click.option(
+    '--worker-id',
+    'worker_id',
+    default='{0}:{1}'.format(socket.gethostname(), os.getpid()),
+    help='Name this worker uses for its partition leases and match claims'
+)
+@click.option(
+    '--metrics-port',
+    'metrics_port',
+    type=int,
+    default=None,
+    help='Serve metrics in the Prometheus text format over HTTP on this port'
+)
+@click.option(
+    '--metrics-file',
+    'metrics_file',
+    default=None,
+    help='Write metrics in the Prometheus text format to this file after each phase'
+)
+@click.option(
+    '--profile',
+    'profile',
+    is_flag=True,
+    help='Time each phase and the calls inside it, writing the report to profile.json next to config.json'
+)
+@click.option(
+    '--profile-stacks',
+    'profile_stacks',
+    is_flag=True,
+    help='With --profile, also sample every thread\'s stack, writing them to profile.collapsed for flame graphs'
+)
+@click.option(
+    '--profile-memory',
+    'profile_memory',
+    is_flag=True,
+    help='With --profile, also trace each phase\'s peak memory with tracemalloc (slows the sync down several times)'
+)
+@click.option(
+    '--budget',
+    'budget',
+    type=int,
+    default=None,
+    help='Most calls to the rate limited endpoints this run may make; stats work that doesn\'t fit waits for the next run'
+)
+@click.option(
+    '--deadline',
+    'deadline',
+    type=float,
+    default=None,
+    help='Minutes after which no more stats work is started; the rest waits for the next run'
+)
+@click.pass_context
+def sync(ctx, loglevel, echo, engine, concurrency, batch_size, stream, queue_depth, chunk_size, cache, resume, partitions, worker_id, metrics_port, metrics_file, profile, profile_stacks, profile_memory, budget, deadline):
     """
     Program to sync data from the Player Unknown Battlegrounds API into a MySQL
     database, for analysis and pretty nerd graphs.
+
+    On its own it makes a single sync pass; use the daemon command to keep
+    syncing on an interval instead.
+    """
+
+    # Everything a pass needs, for the subcommands too. The log file and the
+    # DB and API connections are only set up once we know a command is going
+    # to run, so that --help works without any config, and doesn't truncate
+    # the log of a daemon that's running.
+    ctx.obj = dict(
+        loglevel=loglevel,
+        echo=echo,
+        engine=engine,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        cache=cache,
+        resume=resume,
+        partitions=partitions,
+        worker_id=worker_id,
+        metrics_port=metrics_port,
+        metrics_file=metrics_file,
+        profile=profile,
+        profile_stacks=profile_stacks,
+        profile_memory=profile_memory,
+        budget=budget,
+        deadline=deadline,
+        stream=stream,
+        queue_depth=queue_depth,
+        chunk_size=chunk_size
+    )
+
+    if ctx.invoked_subcommand is None:
+        __setup_logging(ctx.obj)
+        api, pubgdb = __connect(ctx, ctx.obj)
+        __run_pass(api, pubgdb, ctx.obj, resume)
+
+@sync.command()
+@click.option(
+    '--interval',
+    'interval',
+    type=float,
+    default=DEFAULT_INTERVAL,
+    help='Minutes between the starts of the sync passes'
+)
+@click.option(
+    '--passes',
+    'passes',
+    type=int,
+    default=None,
+    help='Stop after this many passes (default: keep going until stopped)'
+)
+@click.pass_context
+def daemon(ctx, interval, passes):
+    """
+    Keep syncing, one incremental pass every --interval minutes, until sent
+    SIGTERM or SIGINT. The API client and DB connections stay up between
+    passes, so each pass keeps the warm HTTP connections, the rate limiter's
+    view of the buckets, the response cache and the seasons from the last
+    one. A pass that fails is resumed by the next.
+    """
+
+    obj = ctx.obj
+    __setup_logging(obj)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info("daemon: Got signal {0}, stopping after the current pass".format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    api, pubgdb = __connect(ctx, obj)
+
+    resume = obj['resume']
+    num_passes = 0
+
+    while not stop.is_set():
+        started = time.monotonic()
+
+        try:
+            __run_pass(api, pubgdb, obj, resume)
+        except Exception as e:
+            logging.exception("daemon: Sync pass failed, the next pass will resume it")
+
+        # From here on resume whatever the last pass left unfinished; if it
+        # finished, that just starts a new run
+        resume = True
+        num_passes += 1
+
+        if passes is not None and num_passes >= passes:
+            break
+
+        wait = interval * 60 - (time.monotonic() - started)
+        logging.info("daemon: Pass {0} took {1:.0f}s, next in {2:.0f}s".format(num_passes, time.monotonic() - started, max(wait, 0)))
+        stop.wait(max(wait, 0))
+
+    logging.info("daemon: Stopped after {0} passes".format(num_passes))
+
+@sync.command('rebuild-rollups')
+@click.pass_context
+def rebuild_rollups(ctx):
+    """
+    Rebuild the rollup tables the dashboards read (player_daily_stats) from
+    the whole match history. The sync keeps them up to date as it goes; this
+    is for recovering them if they're lost or have drifted.
+    """
+
+    __setup_logging(ctx.obj)
+
+    started = time.monotonic()
+
+    DailyRollups(__connect_db(ctx.obj)).rebuild()
+
+    logging.info("rebuild_rollups: Rebuilt in {0:.0f}s".format(time.monotonic() - started))
+
+def __setup_logging(options):
+    """
+    Starts the log file, sync.log next to config.json.
     """
 
+    loglevel = options['loglevel']
     numeric_level = getattr(logging, loglevel.upper(), None)
     logging.basicConfig(filename=os.environ.get('PUBGDB_CONFIG_PATH') + 'sync.log', filemode='w', level=numeric_level, format='%(asctime)s:%(levelname)s:%(message)s')
     # Turn SQL Alchemy logging to the entered value
@@ -35,6 +284,13 @@ def sync(loglevel, echo):
     logging.getLogger('sqlalchemy.dialects').setLevel(logging.getLevelName(loglevel))
     logging.getLogger('sqlalchemy.pool').setLevel(logging.getLevelName(loglevel))
 
+    return None
+
+def __connect_db(options):
+    """
+    Builds the DB connector from the environment.
+    """
+
     user = os.environ.get('PUBGDB_USERNAME')
     password = os.environ.get('PUBGDB_PASSWORD')
     host = os.environ.get('PUBGDB_HOST')
@@ -43,54 +299,130 @@ def sync(loglevel, echo):
     db_uri = 'mysql+pymysql://{0}:{1}@{2}/{3}'.format(user, password, host, database)
         #db_uri = 'sqlite:///:memory:'
 
-    pubgdb = PUBGDatabaseConnector(db_uri, echo)
+    return PUBGDatabaseConnector(db_uri, options['echo'], options['batch_size'])
+
+def __connect(ctx, options):
+    """
+    Builds the DB connector and the API client from the environment,
+    config.json and the command line options. The API client is closed when
+    the command finishes.
+    """
+
+    pubgdb = __connect_db(options)
 
     config = json.load(open(os.environ.get('PUBGDB_CONFIG_PATH') + 'config.json'))
+
+    if options['engine'] is not None:
+        config['engine'] = options['engine']
+    if options['concurrency'] is not None:
+        config['concurrency'] = options['concurrency']
+    if options['cache']:
+        config.setdefault('cache_path', os.environ.get('PUBGDB_CONFIG_PATH') + 'api_cache.sqlite')
+    else:
+        config['cache_path'] = None
+
+    if options['partitions'] is None:
+        options['partitions'] = config.get('partitions', 1)
+
+    metrics.configure(options['metrics_port'], options['metrics_file'])
+
+    if options['profile']:
+        profiling.PROFILER.start(options['profile_stacks'], trace_memory=options['profile_memory'])
+        ctx.call_on_close(profiling.PROFILER.stop)
+
     api = pubg_api(config)
+    ctx.call_on_close(api.close)
 
-    __sync(api, pubgdb)
+    return api, pubgdb
 
-def __sync(api, pubgdb):
-    logging.info("Beginning sync run")
+def __run_pass(api, pubgdb, options, resume):
+    """
+    One sync pass, with its own run state, budget and deadline.
+    """
 
-    # Get the last sync datetime, for use later on. Check that this isn't the first sync
-    # and if it is, set the last_sync_datetime to 1970-01-01 00:00:00
-    sess = pubgdb.Session()
-    
-    q = sess.query(SystemInformation).filter_by(key="Last Sync Datetime").one_or_none()
+    deadline = options['deadline']
+    scheduler = BudgetScheduler(api, options['budget'], None if deadline is None else deadline * 60)
 
-    sess.close()
+    try:
+        __run_partitions(api, pubgdb, options, resume, scheduler)
+    finally:
+        # make sure the files have the end of a pass that failed too
+        if options['metrics_file'] is not None:
+            metrics.REGISTRY.dump()
 
-    if q is None:
-        last_sync_datetime = datetime.datetime(1970, 1, 1)
-        logging.debug("Last Sync Datetime not found in DB, setting to {0}".format(last_sync_datetime))
-    else:
-        last_sync_datetime = datetime.datetime.strptime(q.value, '%Y-%m-%d %H:%M:%S')
-        logging.debug("Last Sync Datetime selected from DB as {0}".format(last_sync_datetime))
+        if options['profile']:
+            profiling.set_phase(None)
+            profiling.PROFILER.write(
+                os.environ.get('PUBGDB_CONFIG_PATH') + 'profile.json',
+                os.environ.get('PUBGDB_CONFIG_PATH') + 'profile.collapsed'
+            )
 
-    logging.info("Beginning get_players() call")
-    api.get_players()
+    return None
+
+def __run_partitions(api, pubgdb, options, resume, scheduler):
+    """
+    Run the pass over all the players, or, if they're split into
+    partitions, over each partition this worker can lease in turn.
+    """
+
+    if options['partitions'] <= 1:
+        api.reset()
+
+        run = SyncRunState(pubgdb)
+        run.start(resume)
+
+        __sync(api, pubgdb, run, scheduler, options['stream'], options['queue_depth'], options['chunk_size'])
+
+        return None
+
+    leases = PartitionLeases(pubgdb, options['partitions'], options['worker_id'])
+    claims = MatchClaims(pubgdb, options['worker_id'])
+    player_names = api.player_names
+
+    try:
+        with closing(leases.due()) as partitions:
+            for partition_id in partitions:
+                api.reset()
+                api.player_names = [n for n in player_names if partition_for(n, options['partitions']) == partition_id]
 
-    # We want to record the IDs of NEW players (I.E. those not yet present in the database) for 
-    # use later on.
+                logging.info("Syncing partition {0} of {1}, {2} players".format(partition_id, options['partitions'], len(api.player_names)))
 
-    sess = pubgdb.Session()
+                # We hold the lease, so a run of this partition that's still
+                # 'running' belongs to a worker that died: carry it on
+                run = SyncRunState(pubgdb, partition_id)
+                run.start(True)
 
-    new_players = []
+                __sync(api, pubgdb, run, scheduler, options['stream'], options['queue_depth'], options['chunk_size'], claims)
+    finally:
+        api.player_names = player_names
 
-    for p in api.players:
-        if sess.query(Player).filter_by(player_id=p['id']).one_or_none() is None:
-            new_players.append(p['id'])
+    return None
 
-    sess.close()
+def __sync(api, pubgdb, run, scheduler, stream=False, queue_depth=DEFAULT_QUEUE_DEPTH, chunk_size=DEFAULT_CHUNK_SIZE, claims=None):
+    logging.info("Beginning sync run")
+
+    # Each phase is checkpointed in the run state, and so is every chunk of
+    # the long ones once it's been written. On a resumed run the players and
+    # seasons are looked up again (they're cheap, and the players' match lists
+    # are what tell us what's new), but any match or stats fetch that was
+    # already written is skipped.
+
+    run.begin_phase('players')
+
+    logging.info("Beginning get_players() call")
+    api.get_players()
+
+    planner = SyncPlanner(pubgdb)
 
     logging.info("Beginning upsert_players() call")
     pubgdb.upsert_players(api.players)
 
+    run.begin_phase('seasons')
+
     logging.info("Beginning get_seasons() call")
-    api.get_seasons()
-    logging.info("Beginning upsert_seasons() call")
-    pubgdb.upsert_seasons(api.seasons)
+    __get_seasons(api, pubgdb)
+
+    run.begin_phase('matches')
 
     logging.info("Beginning get_matches() call")
 
@@ -99,116 +431,216 @@ def __sync(api, pubgdb):
     # data will never change after the fact). Additionally, we need to make sure we 
     # only sync each match a single time.
 
-    sess = pubgdb.Session()
-
-    process_matches = []
-
-    for player in api.players:
-        for match in player['relationships']['matches']['data']:
-            q = sess.query(PlayerMatchStats).filter_by(player_id=player['id'], match_id=match['id'])
-            # If we already added it, or it already exists in the database
-            if (match['id'] in process_matches) or (q.one_or_none() is not None):
-                continue
-            else:
-                process_matches.append(match['id'])
+    process_matches = run.pending('matches', planner.matches_to_fetch(api.players))
+    player_ids = None
+
+    if claims is not None:
+        # When the players are split between workers, a match can be played
+        # by players from more than one partition. Only fetch the ones we win
+        # the claim on, and write the stats of every tracked player in them,
+        # not just ours, so the other workers have nothing left to fetch.
+        process_matches = claims.claim(process_matches)
+        player_ids = pubgdb.player_ids()
+
+    if stream:
+        # fetch, parse and write the matches a chunk at a time, so the writes
+        # overlap the downloads and we never hold every match in memory
+        for matches in api.stream_matches(process_matches, chunk_size, queue_depth):
+            __write_matches(api, pubgdb, run, matches, player_ids)
+    else:
+        for chunk in chunks(process_matches, chunk_size):
+            api.get_matches(chunk)
+            __write_matches(api, pubgdb, run, api.take('matches'), player_ids)
 
-    sess.close()
+    # Player_season_stats and lifetime_stats are disgustingly slow due to rate limited endpoints,
+    # so we need to only make calls for the current season and for expired seasons that don't already exist as
+    # well as only for players who've played a match since their stats were last written (or are new). Each
+    # player has their own watermark for that, so a run that dies partway doesn't lose anyone.
 
-    api.get_matches(process_matches)
-    logging.info("Beginning upsert_matches() call")
-    pubgdb.upsert_matches(api.matches)
+    process_players = planner.players_to_process(api.players)
 
+    # Link the players to their matches, leaving out any match that isn't in
+    # the DB (it failed to fetch, or another worker hasn't written it yet);
+    # the next run links those
     logging.info("Beginning upsert_player_matches() call")
-    pubgdb.upsert_player_matches(api.players)
-    logging.info("Beginning upsert_player_match_stats() call")
-    pubgdb.upsert_player_match_stats(api.matches, api.players)
+    pubgdb.upsert_player_matches(api.players, planner.known_matches)
+
+    run.begin_phase('season_stats')
 
     logging.info("Beginning get_player_season_stats() call")
 
-    # Player_season_stats and lifetime_stats are disgustingly slow due to rate limited endpoints,
-    # so we need to only make calls for the current season and for expired seasons that don't already exist as
-    # well as only for players who've played a match since the last sync.
+    # Get the current season, and make a player-season combo for all players for the
+    # current season
+    current_season_id = api.get_current_season()[0]['id']
 
-    # First, build a table of when matches were played
+    current_combos = [(p, current_season_id) for p in process_players]
 
-    sess = pubgdb.Session()
+    # Every combo of player and expired season that we don't hold data for yet
+    backfill_combos = planner.season_combos(api.players, api.seasons)
 
-    match_datetimes = {m.match_id:m.createdAt for m in sess.query(Match).all()}
+    logging.info("Planning took {0:.3f}s".format(planner.elapsed))
 
-    sess.close()
+    # The work is handed out in priority order - the current season, then
+    # lifetime stats, then the backfill of expired seasons - for as long as
+    # the run's budget and deadline last, so fresh data never waits behind
+    # history. Whatever doesn't fit isn't written, so it comes round again
+    # next run. Each chunk is written away before the next is fetched.
+    season_cost = lambda combos: api.estimate_calls(combos, 'season')
 
-    # Next, build a list of players who've played since the last sync or are new
+    for chunk in scheduler.schedule('current_season', run.pending('season_stats', current_combos, combo_key), chunk_size, season_cost):
+        __fetch_season_stats(api, pubgdb, run, 'season_stats', chunk)
 
-    process_players = [] + new_players
+    run.begin_phase('lifetime_stats')
 
-    for p in api.players:
-        if len(p['relationships']['matches']['data']) > 0:
-            if max([match_datetimes[m['id']] for m in p['relationships']['matches']['data']]) >= last_sync_datetime:
-                process_players.append(p['id'])
-    
-    # dedupedeloopwoop
-    process_players = list(set(process_players))
+    logging.info("Beginning get_player_lifetime_stats() call")
+    # We only call player lifetime stats for players already identified as having played a match since their last refresh
+    lifetime_cost = lambda players: api.estimate_calls([(p, 'lifetime') for p in players], 'lifetime')
 
-    # Get the current season, and add in a player-season combo for all players for the
-    # current season to the process list
-    current_season_id = api.get_current_season()[0]['id']
+    for chunk in scheduler.schedule('lifetime', run.pending('lifetime_stats', process_players), chunk_size, lifetime_cost):
+        api.get_player_lifetime_stats(chunk)
 
-    process_me = []
-    process_me += [(p, current_season_id) for p in process_players]
+        logging.info("Beginning upsert_player_lifetime_stats() call for {0} players".format(len(chunk)))
+        written = pubgdb.upsert_player_lifetime_stats(api.take('player_lifetime_stats'))
 
-    # Build a list of player-seasons to check, meaning every possible combo where isCurrentSeason is false
-    check_me = [(p['id'], s['id']) for p in api.players for s in [s for s in api.seasons if not s['attributes']['isCurrentSeason']]]
-    
-    # For each of those possibilities, check if data exist already
+        __write_fetch_ledger(pubgdb, run, 'lifetime_stats', 'lifetime', lambda combo: combo[0], api.take('fetch_ledger'), written)
 
-    sess = pubgdb.Session()
+    run.begin_phase('watermarks')
 
-    for combo in check_me:
-        q = sess.query(PlayerSeasonStats).filter_by(player_id=combo[0], season_id=combo[1])
-        # If so, skip it
-        if sess.query(q.exists()).one()[0]:
-            continue
-        # Otherwise, add to the list of things to process
-        else:
-            process_me.append(combo)
+    # Move on the watermarks of the players whose current season and lifetime
+    # stats both came back and were committed, in this run or the one it's
+    # resuming; anyone else (including anyone deferred) gets another go next
+    # run.
+    fetched = ('ok', 'empty')
+    season_done = run.done('season_stats')
+    lifetime_done = run.done('lifetime_stats')
 
-    sess.close()
+    done_players = [
+        p for p in process_players
+        if season_done.get(combo_key((p, current_season_id))) in fetched
+        and lifetime_done.get(p) in fetched
+    ]
 
-    # Do the actual processing
-    for combo in process_me:
-        api.get_player_season_stats(combo)
-        api.get_player_ranked_season_stats(combo)
+    logging.info("Beginning upsert_player_watermarks() call for {0} players".format(len(done_players)))
+    pubgdb.upsert_player_watermarks(planner.watermarks(done_players))
 
-    logging.info("Beginning upsert_player_season_stats() call")
-    pubgdb.upsert_player_season_stats(api.player_season_stats)
-    logging.info("Beginning upsert_player_ranked_season_stats() call")
-    pubgdb.upsert_player_ranked_season_stats(api.player_ranked_season_stats)
-    logging.info("Beginning upsert_season_matches() call")
-    pubgdb.upsert_season_matches(api.player_season_stats)
+    run.begin_phase('backfill')
 
-    logging.info("Beginning get_player_lifetime_stats() call")
-    # We only call player lifetime stats for players already identified as having played a match since the last sync
-    api.get_player_lifetime_stats(process_players)
-    logging.info("Beginning upsert_player_lifetime_stats() call")
-    pubgdb.upsert_player_lifetime_stats(api.player_lifetime_stats)
+    logging.info("Beginning backfill of {0} expired player-seasons".format(len(backfill_combos)))
 
-    # Update the last updated time in the db. Remember to check that it 
-    # exists first (to avoid writing upsert logic...)
+    for chunk in scheduler.schedule('backfill', run.pending('backfill', backfill_combos, combo_key), chunk_size, season_cost):
+        __fetch_season_stats(api, pubgdb, run, 'backfill', chunk)
 
-    sess = pubgdb.Session()
+    scheduler.report()
 
-    q = sess.query(SystemInformation).filter_by(key='Last Sync Datetime')
-    if q.one_or_none() is not None:
-        q.update({SystemInformation.value:datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
-    else:
-        lsdt = SystemInformation(key='Last Sync Datetime', value=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        sess.add(lsdt)
+    # Keep the time of the last sync for reference; it isn't used for
+    # planning any more, the per-player watermarks are
+    pubgdb.set_system_information('Last Sync Datetime', datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
 
-    sess.commit()
-    sess.close()
+    run.finish()
 
     logging.info("Sync run complete")
 
+def __fetch_season_stats(api, pubgdb, run, phase, combos):
+    """
+    Fetch and write the season stats for a chunk of combos, and checkpoint
+    them under phase.
+    """
+
+    api.get_season_stats(combos)
+
+    logging.info("Beginning upsert_player_season_stats() call for {0} combos".format(len(combos)))
+    player_season_stats = api.take('player_season_stats')
+    written = pubgdb.upsert_player_season_stats(player_season_stats)
+    written = pubgdb.upsert_player_ranked_season_stats(api.take('player_ranked_season_stats')) and written
+    written = pubgdb.upsert_season_matches(player_season_stats) and written
+
+    __write_fetch_ledger(pubgdb, run, phase, 'season', combo_key, api.take('fetch_ledger'), written)
+
+    return None
+
+def __write_matches(api, pubgdb, run, matches, player_ids=None):
+    """
+    Write a chunk of fetched matches and checkpoint their IDs. player_ids
+    are any more players, on top of ours, to write the match stats of.
+    Matches that didn't come back are in the fetch ledger: those the API
+    doesn't have (404) are checkpointed too, the rest are tried again on
+    resume.
+    """
+
+    matches = [match for match in matches if 'data' in match]
+    match_ids = [match['data']['id'] for match in matches]
+    failures = [entry for entry in api.take('fetch_ledger') if entry['endpoint'] == 'match']
+
+    logging.info("Beginning upsert_matches() call for {0} matches".format(len(matches)))
+    written = pubgdb.upsert_matches(matches)
+    logging.info("Beginning upsert_player_match_stats() call for {0} matches".format(len(matches)))
+    written = pubgdb.upsert_player_match_stats(matches, api.players, player_ids) and written
+
+    if len(failures) > 0:
+        logging.warning("__write_matches: {0} matches failed to fetch".format(len(failures)))
+        pubgdb.upsert_fetch_ledger(failures)
+        run.mark_done('matches', {entry['player_id']: entry['status'] for entry in failures if entry['status'] in SETTLED_STATUSES})
+
+    if written:
+        # the matches themselves are safely written, so a failure here isn't
+        # worth fetching them again for; rebuild-rollups puts it right
+        if not DailyRollups(pubgdb).update(match_ids):
+            logging.error("__write_matches: player_daily_stats is missing {0} matches, run rebuild-rollups".format(len(matches)))
+
+        run.mark_done('matches', {match_id: 'ok' for match_id in match_ids})
+
+    return None
+
+def __write_fetch_ledger(pubgdb, run, phase, endpoint, key, fetch_ledger, written):
+    """
+    Record how a chunk of stats fetches went, so that expired seasons with no
+    data aren't asked about again next time, and if the stats themselves were
+    committed checkpoint the fetches that settled. Anything else is fetched
+    again on resume. If the stats weren't committed, the fetches that got
+    stats are recorded as errors, so that the planner fetches them again.
+    """
+
+    if not written:
+        fetch_ledger = [dict(entry, status='error') if entry['status'] == 'ok' else entry for entry in fetch_ledger]
+
+    logging.info("Beginning upsert_fetch_ledger() call")
+    pubgdb.upsert_fetch_ledger(fetch_ledger)
+
+    if written:
+        run.mark_done(phase, {
+            key((entry['player_id'], entry['season_id'])): entry['status']
+            for entry in fetch_ledger
+            if entry['endpoint'] == endpoint and entry['status'] in SETTLED_STATUSES
+        })
+
+    return None
+
+def __get_seasons(api, pubgdb):
+    """
+    Loads the seasons into the api object, from the seasons table if we
+    fetched them from the API recently enough and the current season doesn't
+    look to have ended since, otherwise from the API.
+    """
+
+    fetched = pubgdb.get_system_information('Seasons Fetched Datetime')
+
+    if fetched is not None:
+        fetched = datetime.datetime.strptime(fetched, '%Y-%m-%d %H:%M:%S')
+
+        if datetime.datetime.utcnow() - fetched < SEASONS_MAX_AGE and not pubgdb.season_ended_since(fetched):
+            api.seasons = pubgdb.load_seasons()
+
+            if len(api.get_current_season()) > 0:
+                logging.debug("Using the seasons cached in the DB, fetched at {0}".format(fetched))
+                return None
+
+    api.get_seasons()
+    logging.info("Beginning upsert_seasons() call")
+    pubgdb.upsert_seasons(api.seasons)
+    pubgdb.set_system_information('Seasons Fetched Datetime', datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+
+    return None
+
 if __name__=='__main__':
 
     sync()